@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Run every tutorial kernel as one benchmark suite.
+
+The kernels from pool_basics, numba_pi, numba_par, lin_alg and
+my_pool are registered below with the problem sizes from their
+__main__ sections. The suite runs them at a chosen scale and set of
+core counts with the rcs_timer benchmark mode, writes the results as
+JSON and compares them against a stored baseline.
+
+It runs headless (matplotlib is forced to the Agg backend) and
+offline (my_pool gets a synthetic word list instead of downloading).
+
+Examples:
+    python bench_suite.py --scale 0.1 --cores 1,2 --output results.json
+    python bench_suite.py --baseline results.json --threshold 0.15
+
+@author: bgregor
+"""
+
+import os
+
+# No windows popping up, whatever plotting gets imported.
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import argparse  # noqa: E402
+import importlib  # noqa: E402
+import json  # noqa: E402
+import multiprocessing as mp  # noqa: E402
+import platform  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import rcs_timer  # noqa: E402
+from get_n_cores import get_n_cores  # noqa: E402
+from word_data import synthetic_words  # noqa: E402
+
+# name -> dict describing how to run a kernel. Filled in by @kernel.
+KERNELS = {}
+
+# Kernel modules that start multiprocessing pools.
+POOL_MODULES = ["pool_basics", "my_pool"]
+
+
+def kernel(name, module, size, parallel=False):
+    """Register a kernel setup function with the suite.
+
+    name: the name used in the results, e.g. "pool_basics.par_calc_pi"
+    module: the tutorial module that must import for the kernel to run.
+    size: the default problem size, taken from the module's __main__.
+    parallel: True if the kernel should run once per core count.
+
+    The setup function is called as setup(mod, size, ncores) and returns
+    a (function, args) pair. Only the function call is timed.
+    """
+
+    def register(setup):
+        KERNELS[name] = {"module": module, "size": size, "parallel": parallel, "setup": setup}
+        return setup
+
+    return register
+
+
+def _unwrap(func):
+    # Strip the @timer decorator so numba dispatchers are timed directly.
+    return getattr(func, "__wrapped__", func)
+
+
+def _numba_threads(ncores):
+    import numba
+
+    # set_num_threads() can't go above NUMBA_NUM_THREADS.
+    numba.set_num_threads(max(1, min(ncores, numba.config.NUMBA_NUM_THREADS)))
+
+
+@kernel("pool_basics.serial_calc_pi", "pool_basics", 1_000_000)
+def _serial_calc_pi(mod, size, ncores):
+    return _unwrap(mod.serial_calc_pi), (size,)
+
+
+@kernel("pool_basics.par_calc_pi", "pool_basics", 1_000_000, parallel=True)
+def _par_calc_pi(mod, size, ncores):
+    return _unwrap(mod.par_calc_pi), (size, ncores)
+
+
+@kernel("numba_pi.calc_pi_numpy", "numba_pi", 5_000_000)
+def _calc_pi_numpy(mod, size, ncores):
+    return _unwrap(mod.calc_pi_numpy), (size,)
+
+
+@kernel("numba_pi.calc_pi_numba", "numba_pi", 5_000_000, parallel=True)
+def _calc_pi_numba(mod, size, ncores):
+    _numba_threads(ncores)
+    return _unwrap(mod.calc_pi_numba), (size,)
+
+
+@kernel("numba_par.np_auto", "numba_par", 10_000)
+def _np_auto(mod, size, ncores):
+    rng = mod.np.random.default_rng(0)
+    return _unwrap(mod.np_auto), (rng.uniform(-100, 100, [size, size]),)
+
+
+@kernel("numba_par.for_loop", "numba_par", 10_000, parallel=True)
+def _for_loop(mod, size, ncores):
+    _numba_threads(ncores)
+    rng = mod.np.random.default_rng(0)
+    return _unwrap(mod.for_loop), (rng.uniform(-100, 100, [size, size]),)
+
+
+@kernel("lin_alg.matmul", "lin_alg", 3000, parallel=True)
+def _matmul(mod, size, ncores):
+    rng = mod.np.random.default_rng(0)
+    x = rng.random([size, size])
+    y = rng.random([size, size])
+
+    def matmul(x, y):
+        with mod.threadpoolctl.threadpool_limits(limits=ncores, user_api="blas"):
+            return x @ y
+
+    return matmul, (x, y)
+
+
+@kernel("my_pool.count_letters", "my_pool", 1_000_000)
+def _count_letters(mod, size, ncores):
+    return mod.count_letters, (synthetic_words(size),)
+
+
+@kernel("my_pool.par_count_letters", "my_pool", 1_000_000, parallel=True)
+def _par_count_letters(mod, size, ncores):
+    return mod.par_count_letters, (synthetic_words(size), ncores)
+
+
+def run_suite(names=None, scale=1.0, cores=None, warmup=1, repeats=5, sizes=None):
+    """Run the registered kernels and return a list of result dicts.
+
+    names: kernel names to run, default all of them.
+    scale: multiplies every default problem size.
+    cores: list of core counts for the parallel kernels.
+    sizes: optional dict of name -> size that overrides the scaled size.
+    """
+    names = list(KERNELS) if names is None else names
+    cores = [get_n_cores()] if cores is None else cores
+    sizes = sizes or {}
+    results = []
+    for name in names:
+        spec = KERNELS[name]
+        try:
+            mod = importlib.import_module(spec["module"])
+        except ImportError as err:
+            # A missing optional library (numba, threadpoolctl...) just
+            # skips the kernels that need it.
+            print(f"skipping {name}: {err}")
+            results.append({"kernel": name, "skipped": str(err)})
+            continue
+        size = sizes.get(name, max(1, int(spec["size"] * scale)))
+        for ncores in cores if spec["parallel"] else [1]:
+            func, args = spec["setup"](mod, size, ncores)
+            label = f"{name}[size={size},cores={ncores}]"
+            rcs_timer.benchmark(func, *args, warmup=warmup, repeats=repeats, label=label)
+            record = rcs_timer.get_records()[-1]
+            result = {"kernel": name, "size": size, "cores": ncores}
+            result.update({k: record[k] for k in rcs_timer.CSV_FIELDS if k not in ("name",)})
+            results.append(result)
+    return results
+
+
+def _key(result):
+    return (result["kernel"], result["size"], result["cores"])
+
+
+def compare(results, baseline, threshold=0.10, stat="median"):
+    """Compare results against baseline results. Returns a list of
+    (result, baseline_result, ratio) for every kernel/size/cores that
+    got slower than baseline * (1 + threshold). Baselines of 0 seconds
+    are skipped."""
+    base = {_key(b): b for b in baseline if "skipped" not in b}
+    regressions = []
+    for res in results:
+        if "skipped" in res or _key(res) not in base:
+            continue
+        if base[_key(res)][stat] <= 0:
+            # Too fast for the clock in the baseline, nothing to compare.
+            continue
+        ratio = res[stat] / base[_key(res)][stat]
+        if ratio > 1.0 + threshold:
+            regressions.append((res, base[_key(res)], ratio))
+    return regressions
+
+
+def _metadata():
+    return {
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "n_cores": get_n_cores(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--kernels", help="comma separated kernel names (default: all)")
+    parser.add_argument("--list", action="store_true", help="list the kernels and exit")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the default sizes")
+    parser.add_argument(
+        "--size", action="append", default=[], help="override one size, e.g. numba_par.np_auto=2000"
+    )
+    parser.add_argument("--cores", help="comma separated core counts (default: get_n_cores())")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this results JSON file")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="allowed slowdown vs baseline (0.10 = 10%%)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, spec in KERNELS.items():
+            print(f"{name:32s} size={spec['size']} parallel={spec['parallel']}")
+        return 0
+
+    names = args.kernels.split(",") if args.kernels else None
+    unknown = set(names or []) - set(KERNELS)
+    if unknown:
+        parser.error(f"unknown kernels: {', '.join(sorted(unknown))}")
+    cores = [int(c) for c in args.cores.split(",")] if args.cores else None
+    sizes = {k: int(v) for k, v in (s.split("=") for s in args.size)}
+
+    # Forking after numba has started its worker threads can deadlock,
+    # so the pools get their workers from a forkserver instead. The
+    # preload keeps worker startup as cheap as a plain fork.
+    if "forkserver" in mp.get_all_start_methods():
+        mp.set_start_method("forkserver", force=True)
+        mp.set_forkserver_preload(POOL_MODULES)
+
+    results = run_suite(names, args.scale, cores, args.warmup, args.repeats, sizes)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": _metadata(), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for res, base, ratio in regressions:
+            print(
+                f"REGRESSION {res['label']}: median {res['median']:.4f} sec vs "
+                f"baseline {base['median']:.4f} sec ({ratio:.2f}x)"
+            )
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} of the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Write synthetic Hubway trip CSV files of any size.
+
+get_bike_data_big() downloads about 400 MB of real trips, which needs
+the network and is too small to see how proc_data() scales. This
+writes CSV files with the same columns as the Hubway trip files, of
+any total size split over any number of files, without a download.
+
+The values are random but not uniform: station popularity follows a
+Zipf-like law (the station of rank k gets weight 1/k**skew, so a few
+stations get most of the trips), members and casual riders come in a
+set ratio, casual riders take longer rides and only members have a zip
+code and gender. Start times follow a commuter-ish hourly profile.
+
+Everything comes from the seed: each chunk of rows of each file has
+its own random stream, so the output is the same no matter how many
+processes write it. The files are written in parallel, one per task,
+and a chunk at a time, so the memory use is a few chunks per process
+however big the files are. Use at least as many files as cores to keep
+them all busy.
+
+A manifest in the output directory records the settings, so asking
+for the same data again returns straight away.
+
+Examples:
+    python bike_data_gen.py --size 2GB --files 8 --out /scratch/trips
+    python bike_data_gen.py --rows 1000000 --skew 1.3 --member-ratio 0.6
+
+The wildcard it prints can be passed to proc_data() in par_pandas_dask.py.
+
+@author: bgregor
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from get_n_cores import get_n_cores
+
+# The columns of the 2011-2013 Hubway trip files.
+TRIP_COLUMNS = [
+    "Duration",
+    "Start date",
+    "End date",
+    "Start station number",
+    "Start station",
+    "End station number",
+    "End station",
+    "Bike number",
+    "Member type",
+    "Zip code",
+    "Gender",
+]
+
+# Rows per chunk: each chunk is made and written in one go.
+CHUNK_ROWS = 100_000
+
+# Relative number of trips starting in each hour of the day, with the
+# morning and evening commutes.
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 12, 8, 6, 6, 7, 7, 7, 8, 10, 13, 11, 8, 6, 4, 3, 2]
+
+# Median ride length in seconds and the spread of its log, for members
+# and casual riders.
+DURATION_PARAMS = {"Member": (600.0, 0.7), "Casual": (1500.0, 0.9)}
+MAX_DURATION = 12 * 3600
+
+MANIFEST = "trips.json"
+FILE_PATTERN = "bike_{}.csv"
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 10**3, "MB": 10**6, "GB": 10**9, "TB": 10**12}
+
+
+def parse_size(text):
+    """Bytes in a size like 500MB, 2GB or 1000000."""
+    text = str(text).strip().upper()
+    digits = text.rstrip("KMGTB ")
+    unit = text[len(digits) :].strip()
+    if unit not in SIZE_UNITS:
+        raise ValueError(f"unknown size unit in {text!r}")
+    return int(float(digits) * SIZE_UNITS[unit])
+
+
+def default_settings(**kwargs):
+    """The generator settings with kwargs replacing the defaults."""
+    settings = {
+        "seed": 0,
+        "stations": 140,
+        "skew": 1.0,
+        "member_ratio": 0.75,
+        "bikes": 1000,
+        "start_date": "2011-07-28",
+        "days": 365,
+    }
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise TypeError(f"unknown settings: {', '.join(sorted(unknown))}")
+    settings.update(kwargs)
+    return settings
+
+
+class TripMaker:
+    """Makes chunks of CSV lines for one set of settings. The station
+    and date tables are made once and reused for every chunk."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        n = settings["stations"]
+        # Station numbers look like the real ones, e.g. B32006.
+        self.numbers = np.array([f"{'ABCDE'[k % 5]}32{k:03d}" for k in range(n)], dtype=object)
+        self.names = np.array([f"Station {k}" for k in range(n)], dtype=object)
+        # Which station gets which popularity rank is random too, so
+        # the busiest one isn't always the first.
+        rank = np.random.default_rng(settings["seed"]).permutation(n) + 1
+        weights = 1.0 / rank ** settings["skew"]
+        self.station_p = weights / weights.sum()
+        hours = np.array(HOUR_WEIGHTS, dtype=float)
+        self.hour_p = hours / hours.sum()
+        start = datetime.date.fromisoformat(settings["start_date"])
+        # One day more than the range, for rides ending after midnight
+        # on the last day (MAX_DURATION is less than a day).
+        days = [start + datetime.timedelta(d) for d in range(settings["days"] + 1)]
+        self.day_text = np.array([f"{d.month}/{d.day}/{d.year} " for d in days], dtype=object)
+        self.minute_text = np.array(
+            [f"{m // 60}:{m % 60:02d}" for m in range(24 * 60)], dtype=object
+        )
+
+    def _dates(self, minutes):
+        return self.day_text[minutes // 1440] + self.minute_text[minutes % 1440]
+
+    def lines(self, n, seed_seq):
+        """n CSV lines (without the newlines) as a list of str."""
+        s = self.settings
+        rng = np.random.default_rng(seed_seq)
+        member = rng.random(n) < s["member_ratio"]
+        median = np.where(member, DURATION_PARAMS["Member"][0], DURATION_PARAMS["Casual"][0])
+        sigma = np.where(member, DURATION_PARAMS["Member"][1], DURATION_PARAMS["Casual"][1])
+        duration = np.clip(median * np.exp(sigma * rng.standard_normal(n)), 60, MAX_DURATION)
+        duration = duration.astype(np.int64)
+        # Minutes since midnight on the first day.
+        start = rng.integers(0, s["days"], n) * 1440 + rng.integers(0, 60, n)
+        start += rng.choice(24, n, p=self.hour_p) * 60
+        end = start + duration // 60
+        from_st = rng.choice(s["stations"], n, p=self.station_p)
+        to_st = rng.choice(s["stations"], n, p=self.station_p)
+        bike = rng.integers(1, s["bikes"] + 1, n)
+        zip_code = rng.integers(2100, 2500, n)
+        female = rng.random(n) < 0.3
+
+        member_type = np.where(member, "Member", "Casual")
+        zip_text = np.where(member, np.char.add("'0", zip_code.astype(str)), "")
+        gender = np.where(member, np.where(female, "Female", "Male"), "")
+        fields = [
+            duration.astype(str),
+            self._dates(start),
+            self._dates(end),
+            self.numbers[from_st],
+            self.names[from_st],
+            self.numbers[to_st],
+            self.names[to_st],
+            np.char.add("B", np.char.zfill(bike.astype(str), 5)),
+            member_type,
+            zip_text,
+            gender,
+        ]
+        # Joining the fields of each row is much faster than adding the
+        # columns together, which copies the growing lines every time.
+        return list(map(",".join, zip(*(field.tolist() for field in fields))))
+
+
+def _chunk_seed(seed, file_no, chunk_no):
+    """The random stream of one chunk of one file."""
+    return np.random.SeedSequence(seed, spawn_key=(file_no, chunk_no))
+
+
+def write_file(path, file_no, settings, max_bytes=None, max_rows=None):
+    """Write trips to path until it has max_bytes (cut at a line end) or
+    max_rows rows. file_no picks the random streams, so every file of a
+    data set needs its own. Returns the number of rows written."""
+    maker = TripMaker(settings)
+    header = ",".join(TRIP_COLUMNS) + "\n"
+    size = len(header)
+    rows = 0
+    chunk_no = 0
+    with open(path + ".part", "w", newline="") as f:
+        f.write(header)
+        while (max_rows is None or rows < max_rows) and (max_bytes is None or size < max_bytes):
+            n = CHUNK_ROWS if max_rows is None else min(CHUNK_ROWS, max_rows - rows)
+            lines = maker.lines(n, _chunk_seed(settings["seed"], file_no, chunk_no))
+            if max_bytes is not None:
+                # The lines are ASCII, so characters are bytes.
+                ends = size + np.cumsum([len(line) + 1 for line in lines])
+                n = min(n, int(np.searchsorted(ends, max_bytes)) + 1)
+                size = int(ends[n - 1])
+            f.write("\n".join(lines[:n]))
+            f.write("\n")
+            rows += n
+            chunk_no += 1
+    os.replace(path + ".part", path)
+    return rows
+
+
+def _write_task(task):
+    path, file_no, settings, max_bytes, max_rows = task
+    start = time.perf_counter()
+    rows = write_file(path, file_no, settings, max_bytes, max_rows)
+    return path, rows, time.perf_counter() - start
+
+
+def _read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def generate(
+    out_dir=None, size=None, rows=None, files=1, workers=None, force=False, verbose=True, **settings
+):
+    """Write synthetic trips as files bike_0.csv, bike_1.csv, ... in
+    out_dir (default bike_synthetic in the temp directory) and return
+    the wildcard for them.
+
+    size: total bytes, or a string like "2GB". rows: total rows.
+    Give one of them; they're split evenly over the files.
+    workers: processes writing files (default get_n_cores()).
+    settings: see default_settings(), e.g. seed=1, skew=1.3,
+    member_ratio=0.6.
+
+    If out_dir already has the same data it's left alone, unless
+    force is True."""
+    if (size is None) == (rows is None):
+        raise ValueError("give one of size or rows")
+    if out_dir is None:
+        out_dir = os.path.join(tempfile.gettempdir(), "bike_synthetic")
+    settings = default_settings(**settings)
+    total_bytes = parse_size(size) if size is not None else None
+    wanted = {"settings": settings, "bytes": total_bytes, "rows": rows, "files": files}
+    paths = [os.path.join(out_dir, FILE_PATTERN.format(i)) for i in range(files)]
+    wildcard = os.path.join(out_dir, FILE_PATTERN.format("*"))
+    manifest = _read_manifest(out_dir)
+    done = manifest is not None and manifest["wanted"] == wanted
+    if done and not force and all(os.path.exists(p) for p in paths):
+        return wildcard
+
+    os.makedirs(out_dir, exist_ok=True)
+    # Leftovers from a different run would match the wildcard.
+    if manifest is not None:
+        for name in manifest["files"]:
+            if os.path.exists(os.path.join(out_dir, name)):
+                os.remove(os.path.join(out_dir, name))
+        os.remove(os.path.join(out_dir, MANIFEST))
+
+    tasks = []
+    for i, path in enumerate(paths):
+        file_bytes = None if total_bytes is None else total_bytes // files
+        file_rows = None if rows is None else rows // files + (i < rows % files)
+        tasks.append((path, i, settings, file_bytes, file_rows))
+    workers = min(workers or get_n_cores(), files)
+    start = time.perf_counter()
+    total_rows = 0
+    with Pool(workers) as pool:
+        for path, n, sec in pool.imap_unordered(_write_task, tasks):
+            total_rows += n
+            if verbose:
+                mb = os.path.getsize(path) / 1e6
+                print(f"{path}: {n} rows, {mb:.1f} MB in {sec:.2f} sec")
+    elapsed = time.perf_counter() - start
+
+    written = sum(os.path.getsize(p) for p in paths)
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(
+            {
+                "wanted": wanted,
+                "files": [os.path.basename(p) for p in paths],
+                "rows": total_rows,
+                "bytes": written,
+            },
+            f,
+            indent=2,
+        )
+    if verbose:
+        print(
+            f"{total_rows} rows, {written / 1e6:.1f} MB in {elapsed:.2f} sec "
+            f"({written / 1e6 / elapsed:.1f} MB/s with {workers} processes)"
+        )
+    return wildcard
+
+
+def main(argv=None):
+    defaults = default_settings()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    amount = parser.add_mutually_exclusive_group(required=True)
+    amount.add_argument("--size", help="total size, e.g. 500MB or 2GB")
+    amount.add_argument("--rows", type=int, help="total number of trips")
+    parser.add_argument("--files", type=int, default=1, help="number of CSV files")
+    parser.add_argument("--out", help="output directory (default: in the temp directory)")
+    parser.add_argument("--workers", type=int, help="processes (default: get_n_cores())")
+    parser.add_argument("--seed", type=int, default=defaults["seed"])
+    parser.add_argument("--stations", type=int, default=defaults["stations"])
+    parser.add_argument(
+        "--skew", type=float, default=defaults["skew"], help="station popularity exponent"
+    )
+    parser.add_argument(
+        "--member-ratio", type=float, default=defaults["member_ratio"], help="fraction of members"
+    )
+    parser.add_argument("--bikes", type=int, default=defaults["bikes"])
+    parser.add_argument("--start-date", default=defaults["start_date"], help="YYYY-MM-DD")
+    parser.add_argument("--days", type=int, default=defaults["days"])
+    parser.add_argument("--force", action="store_true", help="write the files even if they exist")
+    args = parser.parse_args(argv)
+
+    wildcard = generate(
+        args.out,
+        size=args.size,
+        rows=args.rows,
+        files=args.files,
+        workers=args.workers,
+        force=args.force,
+        seed=args.seed,
+        stations=args.stations,
+        skew=args.skew,
+        member_ratio=args.member_ratio,
+        bikes=args.bikes,
+        start_date=args.start_date,
+        days=args.days,
+    )
+    print(wildcard)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
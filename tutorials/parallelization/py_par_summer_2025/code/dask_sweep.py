@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Find the fastest way to run proc_data() with Dask on this machine.
+
+proc_data() in par_pandas_dask.py can run with any of Dask's
+schedulers: synchronous (one thread, no parallelism), threads,
+processes, or a dask.distributed LocalCluster with some number of
+worker processes each running some number of threads. Which is fastest
+depends on the machine, the data and the size of the partitions. This
+runs proc_data() with every scheduler, every n_workers x
+threads_per_worker split of the cores for the LocalCluster, and each
+CSV block size, and records:
+
+    the wall time (best, median and the first run, which includes
+    starting things up),
+    the peak memory (RSS) of the busiest worker process and of all of
+    them together, sampled in a background thread,
+    the number of tasks run and the number of partitions.
+
+The fastest configuration is recommended at the end, or the fastest
+whose workers stay under --max-memory.
+
+With no --data the input is synthetic trips from bike_data_gen.py,
+so no network is needed.
+
+Examples:
+    python dask_sweep.py
+    python dask_sweep.py --data "/scratch/trips/bike_*.csv" --blocksizes 32MB,128MB
+    python dask_sweep.py --schedulers threads,distributed --cores 8 --output sweep.json
+
+@author: bgregor
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import dask
+import psutil
+from dask.callbacks import Callback
+
+import rcs_timer
+from get_n_cores import get_n_cores
+from par_pandas_dask import QUERY_COLUMNS, get_bike_data_synthetic, load_trips, proc_data
+
+SCHEDULERS = ["synchronous", "threads", "processes", "distributed"]
+BLOCKSIZES = ["16MB", "64MB", "256MB"]
+
+
+def splits(cores):
+    """The (n_workers, threads_per_worker) pairs that use cores cores."""
+    return [(w, cores // w) for w in range(1, cores + 1) if cores % w == 0]
+
+
+def configurations(cores, schedulers=SCHEDULERS):
+    """The configurations to try with cores cores, as dicts with the
+    "scheduler" and the number of "workers" and "threads" per worker."""
+    configs = []
+    for name in schedulers:
+        if name == "synchronous":
+            configs.append({"scheduler": name, "workers": 1, "threads": 1})
+        elif name == "threads":
+            configs.append({"scheduler": name, "workers": 1, "threads": cores})
+        elif name == "processes":
+            configs.append({"scheduler": name, "workers": cores, "threads": 1})
+        elif name == "distributed":
+            for w, t in splits(cores):
+                configs.append({"scheduler": name, "workers": w, "threads": t})
+        else:
+            raise ValueError(f"unknown scheduler {name!r}")
+    return configs
+
+
+def describe(config):
+    """A short name like "distributed 2x4" (workers x threads)."""
+    if config["scheduler"] == "synchronous":
+        return "synchronous"
+    return f"{config['scheduler']} {config['workers']}x{config['threads']}"
+
+
+class MemorySampler:
+    """Samples the memory (RSS) of this process and all of its child
+    processes in a background thread while it's in use as a context
+    manager. peaks holds the peak of each pid and peak_total the peak
+    of their sum, in bytes."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peaks = {}
+        self.peak_total = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        me = psutil.Process()
+        total = 0
+        for proc in [me] + me.children(recursive=True):
+            try:
+                rss = proc.memory_info().rss
+            except psutil.Error:
+                continue  # it just finished
+            total += rss
+            self.peaks[proc.pid] = max(self.peaks.get(proc.pid, 0), rss)
+        self.peak_total = max(self.peak_total, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+@contextlib.contextmanager
+def _local_scheduler(config):
+    # Runs the dask calculations inside it with a local scheduler and
+    # yields a list that gets an entry for every task run.
+    tasks = []
+    options = {"scheduler": config["scheduler"]}
+    if config["scheduler"] != "synchronous":
+        options["num_workers"] = config["workers"] * config["threads"]
+    with dask.config.set(options), Callback(posttask=lambda *args: tasks.append(1)):
+        yield tasks
+
+
+class _Cluster:
+    # A LocalCluster and its Client, started once for all of the block
+    # sizes. distributed is only imported when it's needed.
+    def __init__(self, config):
+        from dask.distributed import Client, LocalCluster
+
+        start = time.perf_counter()
+        self.cluster = LocalCluster(
+            n_workers=config["workers"],
+            threads_per_worker=config["threads"],
+            dashboard_address=":0",
+            silence_logs=logging.ERROR,
+        )
+        self.client = Client(self.cluster)
+        self.startup = time.perf_counter() - start
+        self.pids = list(self.client.run(os.getpid).values())
+
+    @contextlib.contextmanager
+    def run(self):
+        from dask.distributed import get_task_stream
+
+        tasks = []
+        with get_task_stream(self.client) as stream:
+            yield tasks
+        tasks.extend(stream.data)
+
+    def close(self):
+        self.client.close()
+        self.cluster.close()
+
+
+def run_one(config, data, blocksize, warmup=1, repeats=3, cluster=None):
+    """Run proc_data(data, blocksize) warmup + repeats times with one
+    configuration and return a dict of the results. cluster is a
+    running _Cluster for the distributed configurations."""
+    label = f"{describe(config)} blocksize={blocksize}"
+    runs = warmup + repeats
+    me = psutil.Process()
+    before = {p.pid for p in me.children(recursive=True)}
+    scheduler = cluster.run() if cluster is not None else _local_scheduler(config)
+    with MemorySampler() as mem:
+        with scheduler as tasks, contextlib.redirect_stdout(io.StringIO()):
+            rcs_timer.benchmark(
+                proc_data, data, blocksize=blocksize, warmup=warmup, repeats=repeats, label=label
+            )
+    record = rcs_timer.get_records()[-1]
+    if cluster is not None:
+        worker_pids = cluster.pids
+    elif config["scheduler"] == "processes":
+        # The pool processes are started for each run, they're the
+        # children that weren't there before.
+        worker_pids = [pid for pid in mem.peaks if pid not in before and pid != me.pid]
+    else:
+        worker_pids = [me.pid]
+    result = dict(config)
+    result.update(
+        {
+            "name": describe(config),
+            "blocksize": blocksize,
+            "npartitions": load_trips(data, QUERY_COLUMNS, blocksize).npartitions,
+            "first": record["first"],
+            "min": record["min"],
+            "median": record["median"],
+            "tasks": len(tasks) // runs,
+            "peak_worker_mb": max((mem.peaks.get(p, 0) for p in worker_pids), default=0) / 1e6,
+            "peak_total_mb": mem.peak_total / 1e6,
+        }
+    )
+    if cluster is not None:
+        result["startup"] = cluster.startup
+    return result
+
+
+def sweep(data, configs, blocksizes=BLOCKSIZES, warmup=1, repeats=3, verbose=True):
+    """Run every configuration with every block size. A configuration
+    that fails gets an "error" instead of timings."""
+    results = []
+    for config in configs:
+        cluster = None
+        try:
+            if config["scheduler"] == "distributed":
+                cluster = _Cluster(config)
+            for blocksize in blocksizes:
+                res = run_one(config, data, blocksize, warmup, repeats, cluster)
+                results.append(res)
+                if verbose:
+                    print(_row(res))
+        except Exception as err:
+            res = dict(config, name=describe(config), error=f"{type(err).__name__}: {err}")
+            results.append(res)
+            if verbose:
+                print(f"{res['name']:18s} failed: {res['error']}")
+        finally:
+            if cluster is not None:
+                cluster.close()
+    return results
+
+
+def _row(res):
+    return (
+        f"{res['name']:18s} {res['blocksize']:>6s} {res['npartitions']:5d} parts "
+        f"{res['tasks']:6d} tasks  median {res['median']:7.3f} min {res['min']:7.3f} "
+        f"first {res['first']:7.3f} sec  peak worker {res['peak_worker_mb']:7.1f} MB "
+        f"total {res['peak_total_mb']:7.1f} MB"
+    )
+
+
+def recommend(results, max_memory=None):
+    """The result with the lowest median time, only counting the ones
+    whose busiest worker peaked under max_memory MB if that's given.
+    None if nothing qualifies."""
+    ok = [r for r in results if "error" not in r]
+    if max_memory is not None:
+        ok = [r for r in ok if r["peak_worker_mb"] <= max_memory]
+    return min(ok, key=lambda r: r["median"], default=None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--data", help="CSV files or a Parquet cache (default: synthetic trips)")
+    parser.add_argument("--size", default="256MB", help="size of the synthetic trips")
+    parser.add_argument("--blocksizes", default=",".join(BLOCKSIZES), help="CSV partition sizes")
+    parser.add_argument(
+        "--schedulers", default=",".join(SCHEDULERS), help="comma separated schedulers"
+    )
+    parser.add_argument("--cores", type=int, help="cores to use (default: get_n_cores())")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--max-memory", type=float, help="MB a worker may use")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    schedulers = args.schedulers.split(",")
+    unknown = set(schedulers) - set(SCHEDULERS)
+    if unknown:
+        parser.error(f"unknown schedulers: {', '.join(sorted(unknown))}")
+    cores = args.cores or get_n_cores()
+    data = args.data or get_bike_data_synthetic(args.size, files=cores)
+    configs = configurations(cores, schedulers)
+    print(f"{len(configs)} configurations on {cores} cores, data: {data}")
+
+    results = sweep(data, configs, args.blocksizes.split(","), args.warmup, args.repeats)
+    best = recommend(results, args.max_memory)
+    if best is None:
+        print("No configuration qualifies.")
+    else:
+        print(f"\nRecommended: {best['name']} with blocksize {best['blocksize']}")
+        print(_row(best))
+        if best["scheduler"] == "distributed":
+            print(
+                f"LocalCluster(n_workers={best['workers']}, "
+                f"threads_per_worker={best['threads']})"
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cores": cores, "data": data, "results": results}, f, indent=2)
+    return 0 if best is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
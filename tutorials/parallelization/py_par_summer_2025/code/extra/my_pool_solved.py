@@ -12,9 +12,6 @@ Created on Thu May 13 11:59:29 2021
 import multiprocessing as mp
 import string
 
-from zipfile import ZipFile
-import requests
-import tempfile
 import itertools as its
 import pprint
 import functools 
@@ -29,28 +26,19 @@ from collections import Counter
 
 
 from get_n_cores import get_n_cores
+from word_data import get_word_file, load_words
 
 
-def get_data():
-    ''' Fetches a ZIP file, unpacks it to a file in the temp directory,
-        returns the opened file. The data file is from SuperFastPython,
-        an EXTENSIVE tutorial on using multiprocessing:
+def get_data(path=None, synthetic=None):
+    ''' Returns the list of words in the word file. The data file is from
+        SuperFastPython, an EXTENSIVE tutorial on using multiprocessing:
             https://superfastpython.com/category/multiprocessing/
-        It contains 1M words.
+        It contains 1M words. It's downloaded once and cached by
+        word_data.get_word_file(), which can also use a local file
+        or make a synthetic one.
     '''
-    url = 'https://raw.githubusercontent.com/SuperFastPython/DataSets/main/bin/1m_words.txt.zip'
-    with tempfile.NamedTemporaryFile() as zipf:
-        req = requests.get(url)
-        zipf.write(req.content)
-        # Rewind the file
-        zipf.seek(0)
-        # Open the zip archive for reading 
-        myzip = ZipFile(zipf)
-        # Read all lines from the file 1m_words.txt from the zip file 
-        # Treat it as UTF-8 Unicode text. 
-        all_lines = [word.decode('utf-8') for word in myzip.open('1m_words.txt').readlines()]
     # Strip to remove newline characters and lowercase the strings 
-    return [word.strip().lower() for word in all_lines]
+    return load_words(get_word_file(path, synthetic))
     
     
 ################ This is the original serial solution ################    
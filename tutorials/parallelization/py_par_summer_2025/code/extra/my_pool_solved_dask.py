@@ -16,36 +16,25 @@ from collections import Counter
 
 import string
 
-# A function to download a file of 1M words
-from zipfile import ZipFile
+# A function to get a file of 1M words
+from word_data import get_word_file
 import pprint
-import tempfile
-import requests 
 from get_n_cores import get_n_cores
 
 from rcs_timer import timer
 
-def get_data():
-    ''' Fetches a ZIP file, unpacks it to a file in the temp directory,
-        returns the opened file. The data file is from SuperFastPython,
-        an extensive tutorial on using multiprocessing:
+def get_data(path=None, synthetic=None):
+    ''' Returns the word file as a Dask Bag. The data file is from
+        SuperFastPython, an extensive tutorial on using multiprocessing:
             https://superfastpython.com/category/multiprocessing/
+        It's downloaded once and cached by word_data.get_word_file(),
+        which can also use a local file or make a synthetic one.
     '''
-    url = 'https://raw.githubusercontent.com/SuperFastPython/DataSets/main/bin/1m_words.txt.zip'
-    with tempfile.NamedTemporaryFile() as zipf:
-        req = requests.get(url)
-        zipf.write(req.content)
-        # Rewind the file
-        zipf.seek(0)
-        # Open the zip archive for reading 
-        myzip = ZipFile(zipf)
-        # Read all lines from the file 1m_words.txt from the zip file 
-        # Treat it as UTF-8 Unicode text. 
-        all_lines = [word.decode('utf-8') for word in myzip.open('1m_words.txt').readlines()]
+    # Now that the file is on disk let the Dask Bag read it directly,
+    # in blocks, instead of making a list of all of the words first.
     # Strip to remove newline characters and lowercase the strings 
-    # Return as a Dask Bag. A better approach is to let the Dask Bag
-    # read the file directly, but there's not too much data here. 
-    return db.from_sequence([word.strip().lower() for word in all_lines])
+    words = db.read_text(get_word_file(path, synthetic), blocksize='4MiB')
+    return words.map(str.strip).map(str.lower)
 
 def count_one_word(word):
     ''' Modified count_one_word to only take 1 argument 
@@ -4,12 +4,18 @@ Created on Mon Feb  8 16:21:40 2021
 
 @author: bgregor
 """
-from multiprocessing import Process, Pipe
-import re
+from multiprocessing import Process, Pipe, Queue, Event, Value
+import queue
 import gzip
 from collections import Counter
+import operator
 import time
 
+import numpy as np
+
+from get_n_cores import get_n_cores
+from map_reduce import map_reduce
+
 
 # This demonstrates the Pipe.  Flags are used to indicate to the 
 # worker processes when they should quit.
@@ -17,25 +23,65 @@ import time
 # Check the docs: https://docs.python.org/3/library/multiprocessing.html
 
 
-def get_counts(recv_conn, send_conn):
-    ''' Return a dictionary of digraphs and their counts from a line.'''
+# Vectorized digraph counting. The text is lowercased and turned into
+# bytes, and each byte into a letter code 0-25 (anything else ends up
+# >= 26). Every pair of neighboring letters a,b gets the index 26*a+b,
+# and np.bincount adds them all up into a 26x26 matrix in one step.
+# A non-ASCII character becomes bytes >= 0x80 in UTF-8, so just like
+# with the regex it breaks up a pair of letters.
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def digraph_matrix(text):
+    ''' Return a 26x26 array where [i, j] is the number of times letter i
+        is followed by letter j in text (a str, or UTF-8 bytes). '''
+    if isinstance(text, bytes) and text.isascii():
+        # Pure ASCII: bytes.lower() does the same as str.lower()
+        buf = text.lower()
+    else:
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        buf = text.lower().encode('utf-8')
+    # uint8 math wraps around, so bytes below 'a' become large codes too.
+    codes = np.frombuffer(buf, dtype=np.uint8) - np.uint8(ord('a'))
+    is_letter = codes < 26
+    pairs = is_letter[:-1] & is_letter[1:]
+    index = codes[:-1][pairs].astype(np.intp) * 26 + codes[1:][pairs]
+    return np.bincount(index, minlength=26 * 26).reshape(26, 26)
+
+
+def matrix_to_dict(matrix):
+    ''' Turn a digraph matrix into the {'ab': count} dict get_counts makes. '''
+    rows, cols = np.nonzero(matrix)
+    return {LETTERS[i] + LETTERS[j]: int(matrix[i, j]) for i, j in zip(rows, cols)}
+
+
+def get_counts(recv_conn, send_conn, max_lines=10000):
+    ''' Return a dictionary of digraphs and their counts from the lines
+        waiting in the pipe, up to max_lines at a time.'''
     # Run forever
     while True:
         counter, line = recv_conn.recv()
+        # Grab whatever else is already waiting in the pipe so the
+        # digraphs are counted over many lines at once.
+        lines = []
+        while counter != -1:
+            lines.append(line)
+            if len(lines) >= max_lines or not recv_conn.poll():
+                break
+            counter, line = recv_conn.recv()
+        if lines:
+            counts = matrix_to_dict(digraph_matrix('\n'.join(lines)))
+            # Write the counts to the pipe going back to the main
+            # process.
+            send_conn.send((0, counts))
         if counter == -1:
             # Reader ran out of lines. Close the 
             # pipe.
             send_conn.send( (-1, None) )
             # and quit.
             return
-        tmp = line.lower()
-        counts = {}
-        for m in re.finditer(r'[a-z](?=[a-z])', tmp):
-            graph = tmp[m.start():m.end()+1]
-            counts[graph] = counts.get(graph, 0) + 1
-        # Write the counts to the pipe going back to the main
-        # process.
-        send_conn.send((0, counts))
 
 def read_files(filename, conn):
         with gzip.open(filename,'r') as f:        
@@ -51,6 +97,156 @@ def read_files(filename, conn):
         # to the receiving end of the pipe that it's ok to quit.
         conn.send( (-1,None) )
   
+
+# =============================================================================
+# A faster pipeline. The example above sends one pickled message per line
+# to a single consumer, and one back per line. Here the producer only
+# decompresses, and sends big batches of raw bytes (cut at line breaks)
+# through a bounded Queue to several consumers. If the consumers fall
+# behind the queue fills up and the producer blocks - that's the
+# backpressure. Each consumer keeps its own counts and sends them back
+# once at the end.
+# Instead of a -1 sentinel message, the producer sets an Event when it's
+# done and publishes how many batches it made. The consumers quit once
+# that many batches have been taken off the queue.
+# =============================================================================
+
+def produce_batches(filename, work_q, done, n_batches, stats_q, batch_bytes):
+    ''' Read the gzip file in batches of about batch_bytes bytes, each
+        ending at a line break, and put them on work_q. '''
+    read_t = put_t = 0.0
+    nbytes = batches = 0
+    with gzip.open(filename, 'rb') as f:
+        while True:
+            st = time.perf_counter()
+            batch = f.read(batch_bytes)
+            if batch and not batch.endswith(b'\n'):
+                # Finish the line
+                batch += f.readline()
+            read_t += time.perf_counter() - st
+            if not batch:
+                break
+            st = time.perf_counter()
+            work_q.put(batch)  # blocks while the queue is full
+            put_t += time.perf_counter() - st
+            nbytes += len(batch)
+            batches += 1
+    n_batches.value = batches
+    done.set()
+    stats_q.put(('producer', None, {'bytes': nbytes, 'batches': batches,
+                                    'busy': read_t, 'blocked': put_t}))
+
+
+def consume_batches(work_q, done, n_batches, taken, stats_q, name):
+    ''' Count digraphs in batches from work_q until the producer is done
+        and every batch has been taken. '''
+    counts = np.zeros((26, 26), dtype=np.int64)
+    count_t = get_t = 0.0
+    nbytes = batches = 0
+    while True:
+        st = time.perf_counter()
+        try:
+            batch = work_q.get(timeout=0.05)
+        except queue.Empty:
+            get_t += time.perf_counter() - st
+            with taken.get_lock():
+                if done.is_set() and taken.value >= n_batches.value:
+                    break
+            continue
+        with taken.get_lock():
+            taken.value += 1
+        get_t += time.perf_counter() - st
+        st = time.perf_counter()
+        counts += digraph_matrix(batch)
+        count_t += time.perf_counter() - st
+        nbytes += len(batch)
+        batches += 1
+    # Flush the local counts, once.
+    stats_q.put((name, matrix_to_dict(counts),
+                 {'bytes': nbytes, 'batches': batches,
+                  'busy': count_t, 'blocked': get_t}))
+
+
+def run_pipeline(filename, n_consumers=2, batch_bytes=1 << 20, queue_size=8):
+    ''' Count the digraphs in a gzip file with one producer and n_consumers
+        consumer processes. At most queue_size batches wait in the queue.
+        Returns the Counter of digraphs and a dict of per-stage stats. '''
+    st = time.perf_counter()
+    work_q = Queue(maxsize=queue_size)
+    stats_q = Queue()
+    done = Event()
+    n_batches = Value('l', 0)
+    taken = Value('l', 0)
+    producer = Process(target=produce_batches,
+                       args=(filename, work_q, done, n_batches, stats_q, batch_bytes))
+    consumers = [Process(target=consume_batches,
+                         args=(work_q, done, n_batches, taken, stats_q, f'consumer_{i}'))
+                 for i in range(n_consumers)]
+    producer.start()
+    for c in consumers:
+        c.start()
+
+    # Collect one message per process. Results have to be read before
+    # joining the processes or a big one could block in the queue.
+    pipe_counts = Counter()
+    stats = {}
+    procs = [producer] + consumers
+    while len(stats) < len(procs):
+        try:
+            name, counts, stage_stats = stats_q.get(timeout=1.0)
+        except queue.Empty:
+            # Don't wait forever on a process that died.
+            dead = [p for p in procs if p.exitcode not in (None, 0)]
+            if dead:
+                for p in procs:
+                    p.terminate()
+                raise RuntimeError(f'pipeline process failed with exit code {dead[0].exitcode}')
+            continue
+        if counts is not None:
+            pipe_counts.update(counts)
+        stats[name] = stage_stats
+    for p in procs:
+        p.join()
+        p.close()
+
+    elapsed = time.perf_counter() - st
+    for stage in stats.values():
+        # Throughput while working, and over the whole run.
+        stage['busy_MBps'] = stage['bytes'] / max(stage['busy'], 1e-9) / 1e6
+        stage['MBps'] = stage['bytes'] / elapsed / 1e6
+    stats['elapsed'] = elapsed
+    return pipe_counts, stats
+
+
+# =============================================================================
+# The same count with map_reduce.py: the parent reads the batches and a
+# single pool counts them, adding up the 26x26 count matrices in a tree.
+# Simpler than the pipeline, but the pool reads every batch off the
+# generator up front, so there is no backpressure.
+# =============================================================================
+
+def read_batches(filename, batch_bytes=1 << 20):
+    ''' Yield batches of about batch_bytes bytes of the gzip file, each
+        ending at a line break. '''
+    with gzip.open(filename, 'rb') as f:
+        while True:
+            batch = f.read(batch_bytes)
+            if not batch:
+                return
+            if not batch.endswith(b'\n'):
+                # Finish the line
+                batch += f.readline()
+            yield batch
+
+
+def map_reduce_counts(filename, ncores, batch_bytes=1 << 20):
+    ''' Count the digraphs in a gzip file with map_reduce. Returns a
+        Counter like run_pipeline. '''
+    counts = map_reduce(digraph_matrix, operator.add, read_batches(filename, batch_bytes),
+                        ncores, initial=np.zeros((26, 26), dtype=np.int64))
+    return Counter(matrix_to_dict(counts))
+
+
 if __name__=='__main__':
     filename = 'data/shakespeare.txt.gz'
     
@@ -84,4 +280,20 @@ if __name__=='__main__':
     
     # end time
     et = time.perf_counter()
-    print('Elapsed time (sec): %s' % (et-st))
\ No newline at end of file
+    print('Elapsed time (sec): %s' % (et-st))
+
+    # Now the batched pipeline with several consumers.
+    n_consumers = max(1, get_n_cores() - 1)
+    batch_counts, stats = run_pipeline(filename, n_consumers)
+    print('Batched pipeline elapsed time (sec): %s' % stats['elapsed'])
+    for name in ['producer'] + [f'consumer_{i}' for i in range(n_consumers)]:
+        print(f"  {name}: {stats[name]['batches']} batches, "
+              f"{stats[name]['busy_MBps']:.1f} MB/s while busy, "
+              f"{stats[name]['blocked']:.2f} sec blocked")
+    print(f'Same counts: {batch_counts == pipe_counts}')
+
+    # And with map_reduce on one pool.
+    st = time.perf_counter()
+    mr_counts = map_reduce_counts(filename, get_n_cores())
+    print('map_reduce elapsed time (sec): %s' % (time.perf_counter() - st))
+    print(f'Same counts: {mr_counts == pipe_counts}')
@@ -7,10 +7,15 @@ Created on Thu May 13 11:59:29 2021
 
 # The multiprocessing library
 import multiprocessing as mp
+import operator
+import time
 
 import numpy as np
 
 from get_n_cores import get_n_cores
+from map_reduce import FAN_IN, map_reduce
+from shards import range_shards, shard_reduce
+from shared_array import SharedArray, attach
 
 
 # Sum all even numbers in a range of integers.
@@ -23,23 +28,48 @@ from get_n_cores import get_n_cores
 # those in parallel down to ~16 partial sums, etc...  This calls
 # for recursion.
 # The question is - can we recursively launch multiple Pools?
-# Answer: Yes we can!
+# Answer: Yes we can! See recursive_par_sum().
+
+# But every level pays to start a new pool of processes, inside the
+# one before it. par_sum() does the same tree of partial sums with
+# one pool, using map_reduce.py: the pieces are summed in parallel,
+# then the partial sums are added up FAN_IN at a time on the same
+# workers.
+
+# Sending the pieces of the array to the workers pickles them, which
+# copies the whole array. par_sum() instead puts the array in shared
+# memory once and sends each worker a small descriptor of its piece
+# (see shared_array.py).
+
+# Even better is not to make the array at all. par_sum_range() sends
+# each worker a tiny description of its part of the range, and the
+# worker makes its numbers a cache-sized block at a time (see
+# shards.py). The parent's memory use doesn't depend on the size of
+# the range.
+
+# Pieces per core for par_sum().
+TASKS_PER_CORE = 4
 
 
 def sum_nums(nums):
     """
     nums: a numpy array
     """
-    # Numpy-centric way: use np.where to find
-    # all of the even numbers, then use that
-    # index with np.sum
+    # Numpy-centric way: let np.sum skip the odd numbers with
+    # where=. No index array or copy of the even numbers is made.
     if np.isscalar(nums):
         return nums
-    even_indx = np.where(nums % 2 == 0)
-    return np.sum(nums[even_indx])
+    return np.sum(nums, where=(nums % 2 == 0))
 
 
-def par_sum(nums, ncores):
+def sum_shared(desc):
+    """Sum the even numbers in a piece of a shared array.
+    desc: a shared_array.ArrayDesc
+    """
+    return sum_nums(attach(desc))
+
+
+def recursive_par_sum(nums, ncores):
     """Recursively sum where each recursive call opens its own
     parallel pool of workers.
     nums: a numpy array.
@@ -54,7 +84,44 @@ def par_sum(nums, ncores):
         nrows = len(nums)
         split_nums = np.array_split(nums, int(np.sqrt(nrows)))
         partial_sums = pool.map(sum_nums, split_nums)
-        return par_sum(partial_sums, ncores)
+        return recursive_par_sum(partial_sums, ncores)
+
+
+def par_sum(nums, ncores, shared=True, fan_in=FAN_IN, pool=None):
+    """Sum with one pool: the pieces are summed in parallel and the
+    partial sums are combined fan_in at a time on the same workers.
+    nums: a numpy array, or a SharedArray.
+    ncores: size of the parallel pool
+    shared: pass a numpy array to the workers through shared memory
+            instead of pickling the pieces.
+    pool: a MapReducePool to use instead of starting one.
+    """
+    n = nums.shape[0] if isinstance(nums, SharedArray) else np.size(nums)
+    # When there's just a few values just return
+    # their sum.
+    if n < ncores:
+        return sum_nums(nums.array if isinstance(nums, SharedArray) else nums)
+    npieces = min(n, ncores * TASKS_PER_CORE)
+    if isinstance(nums, SharedArray):
+        # Already in shared memory, nothing to copy.
+        return map_reduce(
+            sum_shared, operator.add, nums.split(npieces), ncores, 0, fan_in, pool=pool
+        )
+    if shared:
+        with SharedArray.from_array(nums) as shared_nums:
+            return par_sum(shared_nums, ncores, shared, fan_in, pool)
+    return map_reduce(
+        sum_nums, operator.add, np.array_split(nums, npieces), ncores, 0, fan_in, pool=pool
+    )
+
+
+def par_sum_range(start, stop, ncores, pool=None):
+    """Sum the even numbers in range(start, stop) without ever making
+    the array. Each worker makes its own numbers.
+    pool: a MapReducePool to use instead of starting one.
+    """
+    shards = range_shards(start, stop, ncores * TASKS_PER_CORE)
+    return shard_reduce(sum_nums, operator.add, shards, ncores, 0, pool=pool)
 
 
 if __name__ == "__main__":
@@ -65,6 +132,30 @@ if __name__ == "__main__":
     # Stick with 1-D.
     nums = np.arange(START_NUM, STOP_NUM, dtype=np.int64)
 
+    start = time.perf_counter()
+    final_sum = recursive_par_sum(nums, get_n_cores())
+    print(f"Recursive pools: {time.perf_counter() - start:.3f} sec")
+
+    start = time.perf_counter()
+    final_sum = par_sum(nums, get_n_cores(), shared=False)
+    print(f"One pool, pickled pieces: {time.perf_counter() - start:.3f} sec")
+
+    start = time.perf_counter()
     final_sum = par_sum(nums, get_n_cores())
+    print(f"One pool, shared memory: {time.perf_counter() - start:.3f} sec")
+
+    # Or make the array in shared memory to start with, then there's
+    # only ever one copy of it.
+    del nums
+    with SharedArray(STOP_NUM - START_NUM, np.int64) as shared_nums:
+        shared_nums.array[:] = np.arange(START_NUM, STOP_NUM, dtype=np.int64)
+        start = time.perf_counter()
+        final_sum = par_sum(shared_nums, get_n_cores())
+        print(f"Shared from the start: {time.perf_counter() - start:.3f} sec")
+
+    # Or don't make the array at all.
+    start = time.perf_counter()
+    final_sum = par_sum_range(START_NUM, STOP_NUM, get_n_cores())
+    print(f"Lazy range shards: {time.perf_counter() - start:.3f} sec")
 
     print(f"The sum of the even numbers between {START_NUM} and {STOP_NUM} is: {final_sum}")
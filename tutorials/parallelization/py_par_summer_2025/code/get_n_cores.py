@@ -6,8 +6,16 @@ A function that can be used to determine the maximum number of
 cores available to Python on the BU SCC.  Can be adapted to and
 used on other systems as well.
 
+Besides NSLOTS this also honors the usual batch scheduler variables
+(SLURM, PBS, SGE, LSF), the CPU affinity mask of the process and
+cgroup v1/v2 CPU quotas, so a container limited to 4 CPUs on a 64
+core host gets 4. core_report() says where the number came from.
+
 @author: bgregor
 """
+import functools
+import glob
+import math
 import os
 import platform
 import subprocess
@@ -17,6 +25,164 @@ import psutil
 # NOTE: This will not report the number of performance or efficiency
 # cores on the latest x86_64 or ARM CPUs.
 
+# Batch scheduler variables that hold the number of cores given to
+# a job on this node, checked in this order.
+SCHEDULER_VARS = [
+    ("SLURM_CPUS_PER_TASK", "slurm"),
+    ("SLURM_CPUS_ON_NODE", "slurm"),
+    ("NSLOTS", "sge"),
+    ("NCPUS", "pbs"),
+    ("PBS_NUM_PPN", "pbs"),
+    ("LSB_DJOB_NUMPROC", "lsf"),
+]
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _parse_cpulist(text):
+    """Turn a Linux cpu list like '0-3,8,10-11' into a list of ints."""
+    cpus = []
+    for part in text.split(","):
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.extend(range(int(lo), int(hi) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def _cgroup_cpu_limit():
+    """Return the CPU quota of this process's cgroup as a number of
+    cores (possibly fractional), or None if there's no quota.
+    Parent cgroups are checked too as their limits also apply."""
+    cgroups = _read("/proc/self/cgroup")
+    if cgroups is None:
+        return None
+    limits = []
+    for line in cgroups.splitlines():
+        _, controllers, path = line.split(":", 2)
+        # Check from the process's own cgroup up to the root. In
+        # containers the cgroup is usually mounted at the root.
+        parts = [p for p in path.split("/") if p]
+        paths = ["/".join(parts[:i]) for i in range(len(parts), -1, -1)]
+        if controllers == "":
+            # cgroup v2: cpu.max holds "<quota> <period>" or "max <period>"
+            for p in paths:
+                text = _read(os.path.join("/sys/fs/cgroup", p, "cpu.max"))
+                if text and not text.startswith("max"):
+                    quota, period = text.split()
+                    limits.append(int(quota) / int(period))
+        elif "cpu" in controllers.split(","):
+            # cgroup v1: a quota of -1 means no limit.
+            for mount in ("cpu", "cpu,cpuacct", "cpuacct,cpu"):
+                for p in paths:
+                    base = os.path.join("/sys/fs/cgroup", mount, p)
+                    quota = _read(os.path.join(base, "cpu.cfs_quota_us"))
+                    period = _read(os.path.join(base, "cpu.cfs_period_us"))
+                    if quota and period and int(quota) > 0:
+                        limits.append(int(quota) / int(period))
+    return min(limits) if limits else None
+
+
+def _topology():
+    """Read the socket, physical core and NUMA layout from sysfs.
+    Returns a dict with a cpu -> (socket, core) map and a NUMA node ->
+    cpu list map. Both are empty on non-Linux systems."""
+    cores = {}
+    numa = {}
+    if platform.system() == "Linux":
+        for cpu_dir in glob.glob("/sys/devices/system/cpu/cpu[0-9]*"):
+            cpu = int(os.path.basename(cpu_dir)[3:])
+            socket = _read(os.path.join(cpu_dir, "topology", "physical_package_id"))
+            core = _read(os.path.join(cpu_dir, "topology", "core_id"))
+            if socket is not None and core is not None:
+                cores[cpu] = (int(socket), int(core))
+        for node_dir in glob.glob("/sys/devices/system/node/node[0-9]*"):
+            cpulist = _read(os.path.join(node_dir, "cpulist"))
+            if cpulist:
+                numa[int(os.path.basename(node_dir)[4:])] = _parse_cpulist(cpulist)
+    return {"cores": cores, "numa": numa}
+
+
+@functools.lru_cache(maxsize=None)
+def probe_system():
+    """Collect everything about the machine that limits the number of
+    usable cores. This is cached, call probe_system.cache_clear() if
+    the affinity or cgroup of the process changes."""
+    logical = psutil.cpu_count(logical=True) or 1
+    physical = psutil.cpu_count(logical=False) or logical
+    affinity = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    topo = _topology()
+    usable_cpus = affinity if affinity is not None else sorted(topo["cores"])
+    # The physical cores that the affinity mask lets us use.
+    if affinity is not None and topo["cores"]:
+        affinity_physical = len({topo["cores"][c] for c in affinity if c in topo["cores"]})
+    else:
+        affinity_physical = None
+    return {
+        "logical": logical,
+        "physical": physical,
+        "affinity": affinity,
+        "affinity_physical": affinity_physical,
+        "cgroup_quota": _cgroup_cpu_limit(),
+        "sockets": len({s for s, _ in topo["cores"].values()}) or None,
+        "numa_nodes": {
+            node: [c for c in cpus if c in usable_cpus] for node, cpus in topo["numa"].items()
+        },
+    }
+
+
+def core_report(use_physical_cores=True, cores_var="NSLOTS"):
+    """Work out the number of cores to use, same arguments as
+    get_n_cores(). Returns a dict with the number of cores in
+    "n_cores" and the place the decision came from in "source":
+
+        env:<var>          the cores_var environment variable
+        <scheduler>:<var>  a batch scheduler variable, e.g. slurm:SLURM_CPUS_PER_TASK
+        cgroup             the container/cgroup CPU quota
+        affinity           the CPU affinity mask of the process
+        psutil             the core count of the whole machine
+
+    along with the system information from probe_system().
+    """
+    info = dict(probe_system())
+    # The hardware limit: cores on the machine, cut down by the
+    # affinity mask and the cgroup quota.
+    if use_physical_cores:
+        limits = [(info["physical"], "psutil"), (info["affinity_physical"], "affinity")]
+    else:
+        affinity = info["affinity"]
+        limits = [(info["logical"], "psutil"), (affinity and len(affinity), "affinity")]
+    if info["cgroup_quota"] is not None:
+        # A quota of 2.5 cores can keep 3 processes busy part of the time.
+        limits.append((max(1, math.ceil(info["cgroup_quota"])), "cgroup"))
+    n_cores, source = limits[0]
+    for n, src in limits[1:]:
+        if n and n < n_cores:
+            n_cores, source = n, src
+
+    if cores_var and cores_var in os.environ:
+        # This checks for the existence of cores_var first, and if
+        # it's found just uses that as the number of cores. Convenient
+        # on the SCC.
+        n_cores, source = int(os.environ[cores_var]), f"env:{cores_var}"
+    else:
+        for var, scheduler in SCHEDULER_VARS:
+            if os.environ.get(var, "").isdigit():
+                # Trust the scheduler, but never go over what this
+                # process can actually run on.
+                if int(os.environ[var]) <= n_cores:
+                    n_cores, source = int(os.environ[var]), f"{scheduler}:{var}"
+                break
+    info.update(n_cores=n_cores, source=source)
+    return info
+
 
 def get_n_cores(use_physical_cores=True, cores_var="NSLOTS"):
     """Get the number of cores that should be used.  This
@@ -26,17 +192,14 @@ def get_n_cores(use_physical_cores=True, cores_var="NSLOTS"):
     fit your own needs, or you can set the NSLOTS variable
     manually before calling this code.
 
+    Then the SLURM, PBS and LSF variables are checked, and
+    otherwise the count of cores is limited by the CPU
+    affinity and the cgroup CPU quota (containers).
+
     Optionally, set the use_physical_cores flag and this
     will just use all available physical cores.
     """
-    # This checks for the existence of cores_var first,
-    # and if it's found just returns that as the number
-    # of cores to use. Convenient on the SCC.
-    if cores_var in os.environ:
-        return int(os.environ[cores_var])
-
-    # Otherwise get the number of cores from psutil
-    return psutil.cpu_count(logical=not use_physical_cores)
+    return core_report(use_physical_cores, cores_var)["n_cores"]
 
 
 if __name__ == "__main__":
@@ -46,6 +209,9 @@ if __name__ == "__main__":
     print(f'Physical cores on this computer: {get_n_cores(use_physical_cores=True, cores_var="")}')
     # Logical cores
     print(f'Logical cores on this computer: {get_n_cores(use_physical_cores=False, cores_var="")}')
+    # Where did the number come from?
+    report = core_report()
+    print(f'Decided by: {report["source"]}, sockets: {report["sockets"]}, NUMA: {report["numa_nodes"]}')
     # Set an environment variable to 3 and retrieve it
     os.environ["TEST_CORES"] = "3"
     print(
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Measure how long each tutorial module takes to import.
+
+Every module is imported in a new Python process with -X importtime,
+which reports the time spent importing each module. This prints the
+total for each tutorial module and the libraries that took the most
+of it. Processes started by multiprocessing with spawn pay this again
+for every worker.
+
+BUDGETS holds the most time each module should take. A module over
+its budget is flagged and the exit code is 1, so this can run as a
+check after changing the imports. The budgets are for a typical
+workstation, use --budget to change them.
+
+Examples:
+    python import_times.py
+    python import_times.py --modules get_n_cores,rcs_timer --repeats 5
+    python import_times.py --budget numba_pi=0.5 --output import_times.json
+
+@author: bgregor
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Import time budgets in seconds. The helpers only use the standard
+# library and psutil; the rest import numpy but leave numba, plotting
+# and dask.distributed until they're used (see lazy_imports.py).
+BUDGETS = {
+    "get_n_cores": 0.1,
+    "rcs_timer": 0.05,
+    "lazy_imports": 0.05,
+    "map_reduce": 0.15,
+    "bike_data_gen": 0.15,
+    "numba_pi": 0.4,
+    "numba_par": 0.4,
+    "lin_alg": 0.5,
+    "tiled_matmul": 0.4,
+    "par_pandas_dask": 1.5,
+    "dask_sweep": 1.5,
+}
+
+
+def tutorial_modules():
+    """The names of the modules in this directory."""
+    names = [
+        os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(HERE, "*.py"))
+    ]
+    return sorted(n for n in names if n != "import_times")
+
+
+def parse_importtime(text):
+    """Parse the -X importtime output into a list of (module, self,
+    cumulative, depth) with the times in seconds. depth is 0 for a
+    module imported by the program itself."""
+    rows = []
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # the header line
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(parts[0]) / 1e6, int(parts[1]) / 1e6, depth))
+    return rows
+
+
+def import_time(module, repeats=3, top=3):
+    """Import module repeats times, each in a new process, and return a
+    dict with the best total "seconds" and the "heaviest" libraries it
+    imported as a list of (name, seconds)."""
+    best = None
+    for _ in range(repeats):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1]
+            return {"module": module, "seconds": None, "error": error, "heaviest": []}
+        rows = parse_importtime(proc.stderr)
+        # The modules are listed after the ones they import, so the
+        # ones module imported come right before it, back to the
+        # previous top level import (like site, at startup).
+        end = max(i for i, row in enumerate(rows) if row[0] == module and row[3] == 0)
+        start = end
+        while start > 0 and rows[start - 1][3] > 0:
+            start -= 1
+        if best is None or rows[end][2] < best[0]:
+            best = (rows[end][2], rows[start:end])
+    total, rows = best
+    # What module imported directly, grouped by package.
+    libs = {}
+    for name, _, cum, depth in rows:
+        if depth == 1:
+            name = name.split(".")[0]
+            libs[name] = libs.get(name, 0.0) + cum
+    heaviest = sorted(libs.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    return {"module": module, "seconds": total, "error": None, "heaviest": heaviest}
+
+
+def check(results, budgets):
+    """Add "budget" and "over" to each result. Returns the results
+    that are over their budget or failed to import."""
+    bad = []
+    for res in results:
+        res["budget"] = budgets.get(res["module"])
+        res["over"] = res["error"] is not None or (
+            res["budget"] is not None and res["seconds"] > res["budget"]
+        )
+        if res["over"]:
+            bad.append(res)
+    return bad
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--modules", help="comma separated modules (default: all of them)")
+    parser.add_argument("--repeats", type=int, default=3, help="imports per module, best is kept")
+    parser.add_argument(
+        "--budget", action="append", default=[], help="a budget in seconds, e.g. numba_pi=0.5"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        name, _, value = item.partition("=")
+        budgets[name] = float(value)
+    modules = args.modules.split(",") if args.modules else tutorial_modules()
+
+    results = [import_time(m, args.repeats) for m in modules]
+    bad = check(results, budgets)
+    for res in results:
+        if res["error"]:
+            print(f"{res['module']:18s} failed: {res['error']}")
+            continue
+        budget = f"/ {res['budget']:.2f}" if res["budget"] is not None else "      "
+        flag = "  OVER BUDGET" if res["over"] else ""
+        libs = ", ".join(f"{name} {sec:.3f}" for name, sec in res["heaviest"])
+        print(f"{res['module']:18s} {res['seconds']:6.3f} {budget} sec  ({libs}){flag}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Import heavy libraries only when they're first used.
+
+Importing numba, dask.distributed or seaborn takes from a fraction of a
+second to a couple of seconds, and every process started with spawn
+(the default on Windows and macOS) imports the module it runs again.
+A program that only needs get_n_cores() from a module shouldn't pay
+for its plotting library.
+
+    numba = lazy_import("numba")
+
+gives a stand-in for the module that imports numba the first time one
+of its attributes is used. That doesn't help with decorators, which use
+the module as soon as the function is defined, so
+
+    @lazy_jit(cache=True, parallel=True)
+    def calc(...):
+
+stands in for @numba.njit(cache=True, parallel=True) and only imports
+numba and makes the dispatcher on the first call. Any other lazy_jit
+functions it calls are made at the same time, as numba needs the
+real dispatchers to compile calls between jitted functions.
+
+See import_times.py for measuring the import time of each module.
+
+@author: bgregor
+"""
+
+import importlib
+import importlib.util
+import sys
+
+
+class LazyModule:
+    # Stands in for a module until one of its attributes is used. It
+    # only imports the module then, with a normal import.
+
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def module(self):
+        """The real module, imported the first time this is called."""
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.module(), name)
+
+    def __repr__(self):
+        state = "lazy" if self._module is None else "imported"
+        return f"<LazyModule {self._name}: {state}>"
+
+
+def lazy_import(name):
+    """Return the module name, or a LazyModule that imports it when one
+    of its attributes is first used. If it's already imported that's
+    returned. A missing module raises ModuleNotFoundError right away."""
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    return LazyModule(name)
+
+
+class LazyJit:
+    # A function that a numba decorator is applied to on first use.
+    # Calling it calls the numba version, and any other attribute (like
+    # signatures, stats or compile) comes from the numba dispatcher.
+    # __name__, __qualname__ and __doc__ are copied from the function
+    # so functools.wraps (in rcs_timer.timer for one) can read them
+    # without triggering the import.
+
+    __slots__ = (
+        "_func",
+        "_decorator",
+        "_args",
+        "_kwargs",
+        "_dispatcher",
+        "__name__",
+        "__qualname__",
+        "__doc__",
+    )
+
+    def __init__(self, func, decorator, args, kwargs):
+        self._func = func
+        self._decorator = decorator
+        self._args = args
+        self._kwargs = kwargs
+        self._dispatcher = None
+        self.__name__ = func.__name__
+        self.__qualname__ = func.__qualname__
+        self.__doc__ = func.__doc__
+
+    def __getattribute__(self, name):
+        # __module__ can't be a slot, it would replace the class's.
+        if name == "__module__":
+            return object.__getattribute__(self, "_func").__module__
+        return object.__getattribute__(self, name)
+
+    @property
+    def py_func(self):
+        return self._func
+
+    def dispatcher(self):
+        """The numba dispatcher, made the first time this is called."""
+        if self._dispatcher is None:
+            numba = importlib.import_module("numba")
+            _resolve(self._func)
+            decorator = getattr(numba, self._decorator)
+            self._dispatcher = decorator(*self._args, **self._kwargs)(self._func)
+        return self._dispatcher
+
+    def __call__(self, *args, **kwargs):
+        return self.dispatcher()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.dispatcher(), name)
+
+    def __repr__(self):
+        state = "lazy" if self._dispatcher is None else repr(self._dispatcher)
+        return f"<LazyJit {self._decorator} {self.__qualname__}: {state}>"
+
+
+def _real(value):
+    if isinstance(value, LazyJit):
+        return value.dispatcher()
+    if isinstance(value, LazyModule):
+        return value.module()
+    return value
+
+
+def _resolve(func):
+    # numba can only compile a call to another jitted function if it
+    # finds a dispatcher, and numba.prange if numba is a module, so
+    # swap the LazyJit and LazyModule globals and closure variables
+    # that func uses for the real things.
+    globs = func.__globals__
+    for name in func.__code__.co_names:
+        if name in globs:
+            globs[name] = _real(globs[name])
+    for cell in func.__closure__ or ():
+        cell.cell_contents = _real(cell.cell_contents)
+
+
+def lazy_jit(decorator="njit", *args, **kwargs):
+    """A lazy version of the numba decorator of that name, e.g.
+    @lazy_jit(parallel=True) for @numba.njit(parallel=True) or
+    @lazy_jit("vectorize", ["float64(float64)"], target="parallel")
+    for @numba.vectorize(...)."""
+
+    def decorate(func):
+        return LazyJit(func, decorator, args, kwargs)
+
+    return decorate
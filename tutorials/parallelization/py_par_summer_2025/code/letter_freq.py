@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Count letter frequency straight from the bytes of a text file.
+
+my_pool.count_letters loops over every character of every word in
+Python. Here the file is memory-mapped and numpy counts the byte
+values a big block at a time with np.bincount. Upper and lower case
+ASCII letters are added together and everything else is dropped.
+
+In UTF-8 the bytes of a non-ASCII character are all >= 0x80, so they
+can't be mistaken for letters. The only non-ASCII characters whose
+str.lower() contains an ASCII letter are U+0130 (capital I with a dot,
+which lowercases to 'i' + a combining dot) and U+212A (the Kelvin sign,
+which lowercases to 'k'). Those are counted separately, so the result
+is exactly the same as count_letters on the lowercased words.
+
+The parallel version splits the file into byte ranges at line breaks.
+Each worker maps the file itself, so the workers share the file's
+pages in the OS page cache instead of being sent pickled strings.
+
+@author: bgregor
+"""
+
+import mmap
+import multiprocessing as mp
+import os
+import pprint
+import string
+from collections import Counter
+
+import numpy as np
+
+from get_n_cores import get_n_cores
+
+# Bytes counted at a time. np.bincount makes an 8 byte integer copy of
+# its input, so this keeps that to 8 MB.
+BLOCK_SIZE = 1 << 20
+
+# Non-ASCII characters that lowercase to an ASCII letter, as
+# (UTF-8 bytes, letter).
+_SPECIAL = [(b"\xc4\xb0", "i"), (b"\xe2\x84\xaa", "k")]
+
+
+def _count_special(block):
+    """Count the _SPECIAL byte sequences in a numpy block of bytes."""
+    counts = {}
+    for seq, letter in _SPECIAL:
+        n = len(seq)
+        match = block[: len(block) - n + 1] == seq[0]
+        for i in range(1, n):
+            match &= block[i : len(block) - n + 1 + i] == seq[i]
+        counts[letter] = counts.get(letter, 0) + int(np.count_nonzero(match))
+    return counts
+
+
+def count_range(filename, start=0, stop=None, block_size=BLOCK_SIZE):
+    """Count the letters a-z (either case) in bytes start..stop of a
+    file. start and stop should be at line breaks. Returns an array of
+    26 counts."""
+    letters = np.zeros(26, dtype=np.int64)
+    size = os.path.getsize(filename)
+    stop = size if stop is None else min(stop, size)
+    if stop <= start:
+        return letters
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < stop:
+            end = min(pos + block_size, stop)
+            if end < stop:
+                # End the block at a line break so no UTF-8 character
+                # is split across blocks.
+                nl = mm.rfind(b"\n", pos, end)
+                if nl < 0:
+                    # A line longer than the block: take all of it.
+                    nl = mm.find(b"\n", end, stop)
+                end = nl + 1 if nl >= 0 else stop
+            # A view of the mapped file, no copy.
+            block = np.frombuffer(mm, dtype=np.uint8, count=end - pos, offset=pos)
+            counts = np.bincount(block, minlength=256)
+            letters += counts[ord("a") : ord("z") + 1] + counts[ord("A") : ord("Z") + 1]
+            if counts[0x80:].any():
+                for letter, n in _count_special(block).items():
+                    letters[ord(letter) - ord("a")] += n
+            # Let go of the view before the mmap gets closed.
+            del block
+            pos = end
+    return letters
+
+
+def to_counter(letters):
+    """Turn an array of 26 counts into a Counter like count_letters makes."""
+    return Counter(
+        {letter: int(n) for letter, n in zip(string.ascii_lowercase, letters.tolist()) if n}
+    )
+
+
+def count_letters_file(filename, block_size=BLOCK_SIZE):
+    """Serial letter count of a file. Same result as
+    my_pool.count_letters on the file's lowercased lines."""
+    return to_counter(count_range(filename, block_size=block_size))
+
+
+def split_ranges(filename, n):
+    """Split a file into about n (start, stop) byte ranges that
+    begin and end at line breaks."""
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+    bounds = [0]
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for i in range(1, n):
+            target = max(bounds[-1], i * size // n)
+            nl = mm.find(b"\n", target)
+            if nl < 0:
+                break
+            if nl + 1 > bounds[-1]:
+                bounds.append(nl + 1)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def par_count_letters_file(filename, ncores, tasks_per_core=4):
+    """Parallel letter count of a file. The file is split into
+    byte ranges and each worker maps and counts its own ranges."""
+    ranges = split_ranges(filename, ncores * tasks_per_core)
+    with mp.Pool(processes=ncores) as pool:
+        partials = pool.starmap(count_range, [(filename, a, b) for a, b in ranges])
+    return to_counter(sum(partials, np.zeros(26, dtype=np.int64)))
+
+
+if __name__ == "__main__":
+    import time
+
+    from my_pool import count_letters
+    from word_data import get_word_file, load_words
+
+    # The cached 1M word file.
+    fname = get_word_file()
+    words = load_words(fname)
+
+    start = time.perf_counter()
+    letter_count = count_letters(words)
+    print(f"count_letters: {time.perf_counter() - start:.3f} sec")
+
+    start = time.perf_counter()
+    file_count = count_letters_file(fname)
+    print(f"count_letters_file: {time.perf_counter() - start:.3f} sec")
+
+    ncores = get_n_cores()
+    start = time.perf_counter()
+    par_count = par_count_letters_file(fname, ncores)
+    print(f"par_count_letters_file: {time.perf_counter() - start:.3f} sec")
+
+    pprint.PrettyPrinter().pprint(file_count)
+    print(f"Same as count_letters: {file_count == letter_count == par_count}")
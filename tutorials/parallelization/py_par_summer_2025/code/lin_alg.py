@@ -5,12 +5,31 @@ BU RCS Parallel Python Tutorial
 A little benchmarking program showing the effect of multiple cores
 on a matrix-matrix multiply.
 
+It sweeps matrix sizes, dtypes and numbers of BLAS threads (set with
+threadpoolctl) for a matrix multiply and a few LAPACK operations,
+and reports the time, GFLOP/s, speedup and parallel efficiency of
+each. tiled_matmul is the out-of-core multiply from tiled_matmul.py,
+to compare with the in-memory one. The results can be written as JSON
+or CSV and the speedup plot saved to a file, so it runs fine on a
+compute node with no display.
+
+Examples:
+    python lin_alg.py
+    python lin_alg.py --ops matmul,solve,svd --sizes 1000,2000 --dtypes float32,float64
+    python lin_alg.py --sizes 4000x500x4000 --threads 1,2,4,8 --output blas.csv --plot speedup.png
+    python lin_alg.py --ops matmul,tiled_matmul --sizes 8000 --memory-budget 128
+
 @author: bgregor
 """
 
-
+import argparse
+import json
+import os
+import shutil
 import sys
+import tempfile
 import time
+import weakref
 
 import numpy as np
 
@@ -18,73 +37,343 @@ import numpy as np
 # number of threads for this demo.  This library is installed
 # by default by Anaconda.
 import threadpoolctl
-import tqdm
+
+import tiled_matmul
 from get_n_cores import get_n_cores
-from matplotlib import pyplot as plt
-from matplotlib.ticker import MaxNLocator
 
-if __name__ == "__main__":
+# Columns of the CSV output.
+CSV_FIELDS = [
+    "op",
+    "shape",
+    "dtype",
+    "threads",
+    "median",
+    "min",
+    "gflops",
+    "speedup",
+    "efficiency",
+]
+
+
+def _random(rng, shape, dtype):
+    a = rng.random(shape)
+    if np.issubdtype(dtype, np.complexfloating):
+        a = a + 1j * rng.random(shape)
+    return a.astype(dtype)
+
+
+def _flop_factor(dtype):
+    # A complex multiply-add is 4 real multiplies and 4 real adds.
+    return 4 if np.issubdtype(dtype, np.complexfloating) else 1
+
+
+# The operations, as op name -> (setup, flops). A shape is (m, k, n):
+# matmul multiplies an m x k by a k x n matrix, solve solves an m x m
+# system for n right hand sides, qr and svd factor an m x k matrix
+# and cholesky factors an m x m one. setup(shape, dtype, rng, opts)
+# returns (function, args) and flops(shape) is the usual operation
+# count for real numbers (Golub & Van Loan). opts is a dict of extra
+# settings, like the "memory_budget" of tiled_matmul.
+
+
+def _setup_matmul(shape, dtype, rng, opts):
+    m, k, n = shape
+    x = _random(rng, [m, k], dtype)
+    y = _random(rng, [k, n], dtype)
+    z = np.empty([m, n], dtype=dtype)
+
+    def matmul(x, y):
+        z[:] = x @ y
+
+    return matmul, (x, y)
+
+
+def _setup_tiled_matmul(shape, dtype, rng, opts):
+    # The out-of-core multiply from tiled_matmul.py, on matrices in
+    # memory-mapped files. The files are deleted with the function.
+    m, k, n = shape
+    tmp = tempfile.mkdtemp(prefix="lin_alg_")
+    x = tiled_matmul.open_memmap(os.path.join(tmp, "x.npy"), [m, k], dtype)
+    x[:] = _random(rng, [m, k], dtype)
+    y = tiled_matmul.open_memmap(os.path.join(tmp, "y.npy"), [k, n], dtype)
+    y[:] = _random(rng, [k, n], dtype)
+    z = tiled_matmul.open_memmap(os.path.join(tmp, "z.npy"), [m, n], dtype)
+    budget = opts.get("memory_budget", tiled_matmul.MEMORY_BUDGET)
+
+    def tiled(x, y):
+        # The tiles are multiplied by as many threads as BLAS is
+        # allowed to use.
+        tiled_matmul.tiled_matmul(x, y, z, memory_budget=budget)
+
+    weakref.finalize(tiled, shutil.rmtree, tmp, ignore_errors=True)
+    return tiled, (x, y)
+
+
+def _setup_solve(shape, dtype, rng, opts):
+    m, _, n = shape
+    # Adding m to the diagonal keeps the system well conditioned.
+    a = _random(rng, [m, m], dtype) + m * np.eye(m, dtype=dtype)
+    return np.linalg.solve, (a, _random(rng, [m, n], dtype))
+
+
+def _setup_cholesky(shape, dtype, rng, opts):
+    m = shape[0]
+    a = _random(rng, [m, m], dtype)
+    # A positive definite (Hermitian) matrix.
+    a = a @ a.conj().T + m * np.eye(m, dtype=dtype)
+    return np.linalg.cholesky, (a,)
+
+
+def _setup_qr(shape, dtype, rng, opts):
+    m, k, _ = shape
+    return np.linalg.qr, (_random(rng, [m, k], dtype),)
+
+
+def _setup_svd(shape, dtype, rng, opts):
+    m, k, _ = shape
+
+    def svd(a):
+        return np.linalg.svd(a, full_matrices=False)
+
+    return svd, (_random(rng, [m, k], dtype),)
+
+
+def _qr_flops(m, k):
+    # Householder QR of an m x k matrix, plus forming the thin Q.
+    m, k = max(m, k), min(m, k)
+    return 2 * (2 * m * k**2 - 2 * k**3 / 3)
+
+
+def _svd_flops(m, k):
+    # Thin SVD (U1, S and V) of an m x k matrix, from Golub & Van Loan's
+    # table for m >= n: Golub-Reinsch is 14mn^2 + 8n^3 and R-SVD, which
+    # does a QR first and is cheaper for tall matrices, 6mn^2 + 20n^3.
+    # LAPACK picks whichever is cheaper.
+    m, n = max(m, k), min(m, k)
+    return min(14 * m * n**2 + 8 * n**3, 6 * m * n**2 + 20 * n**3)
+
+
+OPS = {
+    "matmul": (_setup_matmul, lambda s: 2 * s[0] * s[1] * s[2]),
+    "tiled_matmul": (_setup_tiled_matmul, lambda s: 2 * s[0] * s[1] * s[2]),
+    "solve": (_setup_solve, lambda s: 2 * s[0] ** 3 / 3 + 2 * s[0] ** 2 * s[2]),
+    "cholesky": (_setup_cholesky, lambda s: s[0] ** 3 / 3),
+    "qr": (_setup_qr, lambda s: _qr_flops(s[0], s[1])),
+    "svd": (_setup_svd, lambda s: _svd_flops(s[0], s[1])),
+}
+
+
+def parse_shape(text):
+    """'3000' -> (3000, 3000, 3000), '4000x500x4000' -> (4000, 500, 4000)."""
+    dims = [int(d) for d in text.lower().split("x")]
+    if len(dims) == 1:
+        return (dims[0],) * 3
+    if len(dims) == 3:
+        return tuple(dims)
+    raise ValueError(f"a shape is N or MxKxN, not {text!r}")
+
+
+def time_op(func, args, threads, iters=10, warmup=1):
+    """Time func(*args) with the BLAS library limited to threads
+    threads. Returns the list of elapsed times of the iters runs."""
+    times = []
+    # Normally you'd set OMP_NUM_THREADS (or similar) variable to control
+    # the number of threads before starting Python.
+    # Here set it for the BLAS library with threadpoolctl.
+    with threadpoolctl.threadpool_limits(limits=threads, user_api="blas"):
+        for i in range(warmup + iters):
+            start = time.perf_counter()
+            func(*args)
+            end = time.perf_counter()
+            if i >= warmup:
+                times.append(end - start)  # store elapsed time
+    return times
+
+
+def sweep(
+    ops=("matmul",),
+    shapes=((3000, 3000, 3000),),
+    dtypes=("float64",),
+    threads=None,
+    iters=10,
+    seed=0,
+    progress=True,
+    opts=None,
+):
+    """Run every op for every shape, dtype and thread count. Returns a
+    list of result dicts with the CSV_FIELDS keys plus the list of
+    "times". The speedup and efficiency are relative to the smallest
+    thread count in threads. opts is passed on to the op setups."""
+    opts = opts or {}
+    threads = sorted(threads or range(1, get_n_cores(use_physical_cores=False) + 1))
+    rng = np.random.default_rng(seed)
+    configs = [(op, shape, dtype) for op in ops for shape in shapes for dtype in dtypes]
+    if progress:
+        # tqdm is only needed for the progress bar.
+        import tqdm
+
+        configs = tqdm.tqdm(configs)
+    results = []
+    for op, shape, dtype in configs:
+        setup, flops = OPS[op]
+        dtype = np.dtype(dtype)
+        func, args = setup(shape, dtype, rng, opts)
+        gflop = flops(shape) * _flop_factor(dtype) / 1e9
+        times = {}
+        for n in threads:
+            times[n] = time_op(func, args, n, iters)
+        # The time for the fewest threads
+        t_base = np.median(times[threads[0]])
+        for n in threads:
+            median = float(np.median(times[n]))
+            speedup = t_base / median
+            results.append(
+                {
+                    "op": op,
+                    "shape": "x".join(map(str, shape)),
+                    "dtype": dtype.name,
+                    "threads": n,
+                    "median": median,
+                    "min": min(times[n]),
+                    "gflops": gflop / median,
+                    "speedup": speedup,
+                    # The ideal speedup ratio is equal to the ratio of
+                    # the number of threads used
+                    "efficiency": speedup * threads[0] / n,
+                    "times": times[n],
+                }
+            )
+    return results
+
+
+def best_threads(results, min_efficiency=0.0):
+    """The thread count with the highest GFLOP/s for each op, shape and
+    dtype, as a dict of (op, shape, dtype) -> result. Thread counts with
+    an efficiency below min_efficiency aren't considered, except the
+    smallest one which everything else is compared to."""
+    best = {}
+    for res in results:
+        key = (res["op"], res["shape"], res["dtype"])
+        if key in best and res["efficiency"] < min_efficiency:
+            continue
+        if key not in best or res["gflops"] > best[key]["gflops"]:
+            best[key] = res
+    return best
+
+
+def write_results(results, filename):
+    """Write the results as CSV (.csv) or JSON (anything else)."""
+    if filename.endswith(".csv"):
+        import csv
+
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        meta = {"timestamp": time.time(), "blas": threadpoolctl.threadpool_info()}
+        with open(filename, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+def plot_speedup(results, filename=None):
+    """Plot the speedup against the number of threads, one line per op,
+    shape and dtype. Saved to filename, or shown if there's none."""
+    # matplotlib is only needed here.
+    import matplotlib
+
+    if filename:
+        matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+    from matplotlib.ticker import MaxNLocator
+
+    ax = plt.figure().gca()
+    cores = sorted({res["threads"] for res in results})
+    # The ideal speedup ratio is equal to the number of threads used
+    ax.plot(cores, [c / cores[0] for c in cores], "b--", label="ideal")
+    for op, shape, dtype in dict.fromkeys((r["op"], r["shape"], r["dtype"]) for r in results):
+        rows = [r for r in results if (r["op"], r["shape"], r["dtype"]) == (op, shape, dtype)]
+        ax.plot(
+            [r["threads"] for r in rows],
+            [r["speedup"] for r in rows],
+            "-x",
+            label=f"{op} {shape} {dtype}",
+        )
+    # Force integer horizontal axis
+    ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+    plt.title("Speedup Ratio")
+    plt.xlabel("N Cores")
+    plt.ylabel("S")
+    plt.legend()
+    if filename:
+        plt.savefig(filename)
+        plt.close()
+    else:
+        plt.show()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--ops", default="matmul", help=f"comma separated, from {','.join(OPS)}")
+    # A value of 3000 will use ~800 MB of RAM being used.
+    # A value of 1000 will use ~150 MB of RAM.
+    parser.add_argument("--sizes", default="3000", help="comma separated N or MxKxN shapes")
+    parser.add_argument("--dtypes", default="float64", help="e.g. float32,float64,complex128")
+    parser.add_argument("--threads", help="comma separated thread counts (default: 1..all cores)")
+    # Run for a few iterations to get some averaging
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=tiled_matmul.MEMORY_BUDGET / 2**20,
+        help="MB of tiles for tiled_matmul",
+    )
+    parser.add_argument(
+        "--min-efficiency",
+        type=float,
+        default=0.0,
+        help="only recommend thread counts at least this efficient (0.7 = 70%%)",
+    )
+    parser.add_argument("--output", help="write the results to a .json or .csv file")
+    parser.add_argument("--plot", help="save the speedup plot to this file")
+    parser.add_argument("--show", action="store_true", help="show the speedup plot")
+    args = parser.parse_args(argv)
+
+    ops = args.ops.split(",")
+    unknown = set(ops) - set(OPS)
+    if unknown:
+        parser.error(f"unknown ops: {', '.join(sorted(unknown))}")
+    shapes = [parse_shape(s) for s in args.sizes.split(",")]
+    dtypes = args.dtypes.split(",")
+    threads = [int(t) for t in args.threads.split(",")] if args.threads else None
+
     logical_cores = get_n_cores(use_physical_cores=False)
     real_cores = get_n_cores(use_physical_cores=True)
-
     print(
         "According to psutil this computer has %s logical cores and %s real cores."
         % (logical_cores, real_cores)
     )
     sys.stdout.flush()  # Force that to print.
 
-    # A value of 3000 will use ~800 MB of RAM being used.
-    # A value of 1000 will use ~150 MB of RAM.
-    SIZE = 3000
-    # make a pair of random square matrices.
-    x = np.random.random([SIZE, SIZE])
-    y = np.random.random([SIZE, SIZE])
-
-    # And do a matrix-matrix multiplication to "warm up" the CPU and fill the
-    # memory caches with these arrays.
-    z = x @ y
-
-    # Let's loop over the number of logical cores and set the number of
-    # threads using the threadpoolctl lib.
-    timer = {}
-    # Run for a few iterations to get some averaging
-    ITERS = 10
-    for j in tqdm.tqdm(range(ITERS)):
-        for i in range(1, logical_cores + 1):
-            # Take care of storage:
-            if i not in timer:
-                timer[i] = np.zeros(ITERS)
-            # And now time it:
-            # Normally you'd set OMP_NUM_THREADS (or similar) variable to control
-            # the number of threads before starting Python.
-            # Here set it for the BLAS library with threadpoolctl.
-            with threadpoolctl.threadpool_limits(limits=i, user_api="blas"):
-                start = time.perf_counter()
-                z[:] = x @ y  # matrix-matrix multiply.
-                end = time.perf_counter()
-                timer[i][j] = end - start  # store elapsed time
-
-    # Compute median times.
-    for key in timer:
-        timer[key] = np.median(timer[key])
-
-    # Get the time for 1 core
-    t_one = timer[1]
-    cores = sorted(list(timer.keys()))
-    # Speedup ratio
-    S = [t_one / timer[c] for c in cores]
+    opts = {"memory_budget": int(args.memory_budget * 2**20)}
+    results = sweep(ops, shapes, dtypes, threads, args.iters, opts=opts)
+    for res in results:
+        print(
+            f"{res['op']:12s} {res['shape']:>15s} {res['dtype']:11s} threads={res['threads']:<3d} "
+            f"{res['median']:.4f} sec {res['gflops']:8.1f} GFLOP/s "
+            f"speedup {res['speedup']:.2f} efficiency {res['efficiency']:.0%}"
+        )
+    print("Fastest thread counts:")
+    for (op, shape, dtype), res in best_threads(results, args.min_efficiency).items():
+        print(f"  {op} {shape} {dtype}: {res['threads']} threads, {res['gflops']:.1f} GFLOP/s")
 
-    # The ideal speedup ratio is equal to the number of threads used
-    S_ideal = cores
+    if args.output:
+        write_results(results, args.output)
+        print(f"Results written to {args.output}")
+    if args.plot or args.show:
+        plot_speedup(results, args.plot)
+    return 0
 
-    ax = plt.figure().gca()
-    ax.plot(cores, S_ideal, "b--")
-    ax.plot(cores, S, "r-x")
-    # Force integer horizontal axis
-    ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-    # set axis limits
-    # ax.set_ylim([min(S) * 0.8, max(S) * 1.2])
-    plt.title("Speedup Ratio.  Matrix size %s" % SIZE)
-    plt.xlabel("N Cores")
-    plt.ylabel("S")
-    plt.show()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+A parallel map_reduce with a single process pool.
+
+map_reduce(func, combine, data) calls func on every item of data in
+the pool, then combines the results fan_in at a time, also in the
+pool, round after round until one is left:
+
+    16 results -> 4 -> 1        (fan_in=4)
+
+combine has to be associative, like operator.add on numbers, numpy
+arrays or Counters, so the grouping doesn't change the answer. The
+results are combined in order, so it doesn't have to be commutative.
+
+A MapReducePool keeps its processes open between calls, so several
+reductions only pay once to start them:
+
+    with MapReducePool(4) as pool:
+        total = pool.map_reduce(sum_nums, operator.add, pieces, initial=0)
+        counts = pool.map_reduce(count_batch, operator.add, batches, initial=Counter())
+
+func and combine are sent to the workers, so they must be functions
+defined at the top level of a module (or builtins like operator.add).
+
+@author: bgregor
+"""
+
+import functools
+import multiprocessing as mp
+
+from get_n_cores import get_n_cores
+
+# Results combined per task in each round of the tree.
+FAN_IN = 4
+
+
+def _reduce_group(task):
+    """Pool task: combine a group of results in order."""
+    combine, group = task
+    return functools.reduce(combine, group)
+
+
+class MapReducePool:
+    """A process pool for map_reduce() that stays open between calls.
+    Use it as a context manager or call close() when done."""
+
+    def __init__(self, nprocs=None, fan_in=FAN_IN):
+        if fan_in < 2:
+            raise ValueError("fan_in must be >= 2")
+        self.nprocs = get_n_cores() if nprocs is None else nprocs
+        self.fan_in = fan_in
+        self.pool = mp.Pool(processes=self.nprocs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def map_reduce(self, func, combine, data, initial=None, fan_in=None, chunksize=1, stats=None):
+        """Return combine(...combine(initial, func(data[0]))..., func(data[-1])),
+        worked out in parallel.
+
+        data: any iterable. Note that the pool reads all of it right
+              away, so a generator doesn't save memory here.
+        initial: the result for empty data, and combined in first
+                 otherwise, e.g. 0 for sums or Counter() for Counters.
+        fan_in: results combined per task, default the pool's fan_in.
+        chunksize: items of data sent to a worker at a time.
+        stats: pass a dict to get the number of "map_tasks", the
+               "combine_tasks" and the number of results after each
+               round in "levels".
+        """
+        fan_in = self.fan_in if fan_in is None else fan_in
+        if fan_in < 2:
+            raise ValueError("fan_in must be >= 2")
+        # imap keeps the results in the order of data.
+        results = list(self.pool.imap(func, data, chunksize))
+        levels = [len(results)]
+        combine_tasks = 0
+        # Once only a group's worth is left it's cheaper to finish here
+        # than to send them to a worker.
+        while len(results) > fan_in:
+            groups = [results[i : i + fan_in] for i in range(0, len(results), fan_in)]
+            results = self.pool.map(_reduce_group, [(combine, group) for group in groups])
+            combine_tasks += len(groups)
+            levels.append(len(results))
+        if stats is not None:
+            stats.update(map_tasks=levels[0], combine_tasks=combine_tasks, levels=levels)
+        if initial is not None:
+            return functools.reduce(combine, results, initial)
+        if not results:
+            raise ValueError("map_reduce() of empty data with no initial value")
+        return functools.reduce(combine, results)
+
+
+def map_reduce(
+    func,
+    combine,
+    data,
+    ncores=None,
+    initial=None,
+    fan_in=FAN_IN,
+    chunksize=1,
+    stats=None,
+    pool=None,
+):
+    """map_reduce with a MapReducePool passed as pool, or with a
+    temporary pool of ncores processes. See MapReducePool.map_reduce()
+    for the arguments."""
+    if pool is not None:
+        return pool.map_reduce(func, combine, data, initial, fan_in, chunksize, stats)
+    with MapReducePool(ncores, fan_in) as pool:
+        return pool.map_reduce(func, combine, data, initial, fan_in, chunksize, stats)
+
+
+if __name__ == "__main__":
+    import operator
+
+    stats = {}
+    total = map_reduce(abs, operator.add, range(-1000, 1000), initial=0, chunksize=50, stats=stats)
+    print(f"sum of |n| for n in -1000..999: {total}, {stats}")
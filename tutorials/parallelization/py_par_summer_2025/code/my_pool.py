@@ -12,40 +12,32 @@ import itertools as its
 
 # The multiprocessing library
 import multiprocessing as mp
+import operator
+import pickle
 import pprint
 import string
-import tempfile
+import time
 
 # A Counter is like a dictionary
 # collections is a standard Python library
 # https://docs.python.org/3.12/library/collections.html#collections.Counter
 from collections import Counter
-from zipfile import ZipFile
 
-import requests
 from get_n_cores import get_n_cores
+from map_reduce import map_reduce
+from word_data import get_word_file, load_words
 
 
-def get_data():
-    """Fetches a ZIP file, unpacks it to a file in the temp directory,
-    returns the opened file. The data file is from SuperFastPython,
-    an EXTENSIVE tutorial on using multiprocessing:
+def get_data(path=None, synthetic=None):
+    """Returns the list of words in the word file. The data file is from
+    SuperFastPython, an EXTENSIVE tutorial on using multiprocessing:
         https://superfastpython.com/category/multiprocessing/
-    It contains 1M words.
+    It contains 1M words. It's downloaded the first time and cached, see
+    word_data.get_word_file() for using a local file (path) or a
+    synthetic list of words (synthetic=number of words) instead.
     """
-    url = "https://raw.githubusercontent.com/SuperFastPython/DataSets/main/bin/1m_words.txt.zip"
-    with tempfile.NamedTemporaryFile() as zipf:
-        req = requests.get(url)
-        zipf.write(req.content)
-        # Rewind the file
-        zipf.seek(0)
-        # Open the zip archive for reading
-        myzip = ZipFile(zipf)
-        # Read all lines from the file 1m_words.txt from the zip file
-        # Treat it as UTF-8 Unicode text.
-        all_lines = [word.decode("utf-8") for word in myzip.open("1m_words.txt").readlines()]
     # Strip to remove newline characters and lowercase the strings
-    return [word.strip().lower() for word in all_lines]
+    return load_words(get_word_file(path, synthetic))
 
 
 def count_one_word(alphabet, word):
@@ -73,18 +65,70 @@ def count_letters(words):
     return letter_count
 
 
-def par_count_letters(words, ncores):
-    """A parallel version of count_letters"""
-    with mp.Pool(processes=ncores) as pool:
-        # Create a list of arguments for each word
-        args = [(set(string.ascii_lowercase), word) for word in words]
-        # Map the count_one_word function to the list of words
-        n_in = pool.starmap(count_one_word, args)
+def count_batch(words):
+    """Count the letters in a whole list of words at once. Joining
+    the words lets Counter do all of the counting in C, then the
+    letters outside the alphabet are dropped."""
+    count = Counter("".join(words))
+    return Counter({letter: count[letter] for letter in string.ascii_lowercase if letter in count})
 
+
+def par_count_letters(words, ncores, batch_size=None, stats=None):
+    """A parallel version of count_letters
+
+    With batch_size set each task gets a slice of batch_size words
+    and sends back a single Counter, instead of one task and one
+    Counter per word. The Counters are then added up on the same
+    pool with map_reduce.
+
+    Pass a dict as stats to get the number of tasks and an estimate of
+    the bytes pickled to send the tasks and their results. Measuring it
+    pickles everything a second time, so only ask when you need it.
+    """
+    if batch_size is not None and batch_size < 1:
+        raise ValueError("batch_size must be >= 1")
+    if batch_size is None:
+        with mp.Pool(processes=ncores) as pool:
+            # Create a list of arguments for each word
+            args = [(set(string.ascii_lowercase), word) for word in words]
+            # Map the count_one_word function to the list of words
+            n_in = pool.starmap(count_one_word, args)
         # Combine the results into a single Counter object
         letter_count = Counter()
         for count in n_in:
             letter_count.update(count)
+        n_tasks = len(args)
+        if stats is not None:
+            # starmap sends the words in chunks, chosen the way Pool
+            # does, and gets back a list of Counters per chunk.
+            chunksize = -(-len(args) // (ncores * 4)) or 1
+            sent = received = 0
+            for i in range(0, len(args), chunksize):
+                sent += len(pickle.dumps((count_one_word, args[i : i + chunksize])))
+                received += len(pickle.dumps(n_in[i : i + chunksize]))
+    else:
+        args = [words[i : i + batch_size] for i in range(0, len(words), batch_size)]
+        mr_stats = {}
+        letter_count = map_reduce(
+            count_batch, operator.add, args, ncores, initial=Counter(), stats=mr_stats
+        )
+        n_tasks = mr_stats["map_tasks"] + mr_stats["combine_tasks"]
+        if stats is not None:
+            # The batches are measured. The Counters passed between the
+            # rounds aren't kept, so they're counted as the size of the
+            # final one (each has at most the 26 letters): every round
+            # gets back levels[k] of them and sends all but the last
+            # round's on to be combined.
+            levels = mr_stats["levels"]
+            counter_bytes = len(pickle.dumps(letter_count))
+            sent = sum(len(pickle.dumps((count_batch, batch))) for batch in args)
+            sent += sum(levels[:-1]) * counter_bytes
+            received = sum(levels) * counter_bytes
+
+    if stats is not None:
+        stats["tasks"] = n_tasks
+        stats["est_bytes_sent"] = sent
+        stats["est_bytes_received"] = received
     return letter_count
 
 
@@ -107,3 +151,16 @@ if __name__ == "__main__":
     letter_count_par = par_count_letters(words, ncores)
     # and print it - the results should be the same!
     pp.pprint(letter_count_par)
+
+    # Sending one word per task means pickling a task and a Counter
+    # for every word. Send big slices of words instead.
+    for batch_size in (None, 50_000):
+        stats = {}
+        start = time.perf_counter()
+        letter_count_batch = par_count_letters(words, ncores, batch_size, stats)
+        elapsed = time.perf_counter() - start
+        print(
+            f"batch_size={batch_size}: {elapsed:.3f} sec, {stats['tasks']} tasks, "
+            f"~{stats['est_bytes_sent'] + stats['est_bytes_received']:,} bytes pickled, "
+            f"same counts: {letter_count_batch == letter_count}"
+        )
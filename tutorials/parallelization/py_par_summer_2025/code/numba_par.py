@@ -16,18 +16,28 @@ import os
 if "NUMBA_NUM_THREADS" in os.environ:
     del os.environ["NUMBA_NUM_THREADS"]
 
-import numba
+import functools
+import time
+import tracemalloc
+
 import numpy as np
 from get_n_cores import get_n_cores
 from rcs_timer import timer
 
+# numba takes a while to import, so it's only imported when one of
+# the numba functions is first called. @lazy_jit(...) works just like
+# @numba.njit(...) otherwise, see lazy_imports.py.
+from lazy_imports import lazy_import, lazy_jit
+
+numba = lazy_import("numba")
+
 # Function "for_loop" will be turned into a parallel
 # numba calculation.
 
 
 # %%
 @timer
-@numba.njit(parallel=True, cache=True)
+@lazy_jit(parallel=True, cache=True)
 def for_loop(mat):
     """A double for loop over a 2D numpy ndarray"""
     rows, cols = mat.shape
@@ -44,6 +54,92 @@ def np_auto(mat):
     return mat
 
 
+# np_auto makes a temporary array the size of mat for 2.0 * mat (numpy
+# reuses it for the - 1.0) and then copies it back into mat, so it
+# reads and writes the whole array 3 times over.
+# A fused calculation reads each element once, computes the whole
+# expression and writes it straight back, with no temporaries.
+
+
+# A parallel ufunc: numba compiles the scalar function and runs it over
+# the array with threads. out=mat makes it work in-place.
+@lazy_jit("vectorize", ["float64(float64)"], target="parallel", cache=True)
+def scale_shift(x):
+    return 2.0 * x - 1.0
+
+
+@timer
+def ufunc_inplace(mat):
+    """Fused parallel ufunc, in-place"""
+    return scale_shift(mat, out=mat)
+
+
+# Elements per block for fused(). 16K float64 values is 128 KB, which
+# stays in the L2 cache of most CPUs.
+BLOCK_SIZE = 1 << 14
+
+
+def fused(func):
+    """Make an in-place elementwise function out of a scalar function,
+    e.g. fused(lambda x: 2.0 * x - 1.0). The returned function(mat)
+    applies func to every element of a contiguous array. The array is
+    split into blocks of BLOCK_SIZE elements that the numba threads
+    share out between them."""
+    func = lazy_jit()(func)
+
+    @lazy_jit(parallel=True)
+    def kernel(flat, block):
+        n = flat.size
+        for b in numba.prange((n + block - 1) // block):
+            # Looping over a slice, not indexes into flat, lets the
+            # compiler use SIMD instructions on the block.
+            chunk = flat[b * block : min(n, (b + 1) * block)]
+            for i in range(chunk.size):
+                chunk[i] = func(chunk[i])
+
+    def apply(mat, block=BLOCK_SIZE):
+        # reshape(-1) is a view for a contiguous array, it would be a
+        # copy otherwise and the results would be lost.
+        if not mat.flags.c_contiguous:
+            raise ValueError("fused functions need a C-contiguous array")
+        kernel(mat.reshape(-1), block)
+        return mat
+
+    return functools.wraps(func.py_func)(apply)
+
+
+_scale_shift_blocked = fused(lambda x: 2.0 * x - 1.0)
+
+
+@timer
+def blocked_inplace(mat):
+    """Fused blocked evaluator, in-place"""
+    return _scale_shift_blocked(mat)
+
+
+@timer
+def copy_baseline(mat, out):
+    """Copy mat into out: one read and one write per element, the
+    best an in-place elementwise calculation could do"""
+    np.copyto(out, mat)
+    return out
+
+
+def bandwidth(mat, func, *args, repeats=3):
+    """Best time of func(mat, *args) over repeats calls and the
+    memory bandwidth that means in GB/s, counting one read and one
+    write of mat. Also the peak of the memory numpy allocated."""
+    best = float("inf")
+    tracemalloc.start()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(mat, *args)
+        best = min(best, time.perf_counter() - start)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, 2 * mat.nbytes / best / 1e9, peak
+
+
 # %%
 if __name__ == "__main__":
 
@@ -68,4 +164,20 @@ if __name__ == "__main__":
     # did to the code?  Just type this into the console:
     # print_numba_info()
 
+    # Compare the fused in-place versions with the ones above. Run
+    # each once first so the compile time isn't counted. The peak is
+    # the extra memory allocated during the calls, on top of mat.
+    print(f"\nmat is {mat.nbytes / 1e9:.2f} GB, best of 3:")
+    tests = [
+        ("copy baseline", copy_baseline.__wrapped__, np.empty_like(mat)),
+        ("np_auto", np_auto.__wrapped__),
+        ("for_loop", for_loop.__wrapped__),
+        ("parallel ufunc", ufunc_inplace.__wrapped__),
+        ("blocked", blocked_inplace.__wrapped__),
+    ]
+    for name, func, *args in tests:
+        func(mat, *args)
+        elapsed, gbs, peak = bandwidth(mat, func, *args)
+        print(f"  {name:15s} {elapsed:.3f} sec {gbs:6.1f} GB/s  peak extra {peak / 1e9:.2f} GB")
+
 # %%
@@ -30,10 +30,14 @@ if 'NUMBA_NUM_THREADS' in os.environ:
 
 import numpy as np
 import random
-import numba
 
 from rcs_timer import timer
 from get_n_cores import get_n_cores
+# numba takes a while to import, so it's only imported when one of
+# the numba functions is first called. @lazy_jit(...) works just like
+# @numba.njit(...) otherwise.
+from lazy_imports import lazy_import, lazy_jit
+numba = lazy_import('numba')
 
 ########################################
 #%% Plain Numpy 
@@ -56,8 +60,8 @@ def calc_pi_numpy(total):
 #%% Numba version.  Modify with nopython mode
 # and parallel execution.
 
-@numba.njit
-def get_point_numba(cache=True,):
+@lazy_jit(cache=True)
+def get_point_numba():
     # np.random.uniform is NOT directly supported in numba, it'll
     # call out to Python and Numpy if we use that.  Use np.random.random()
     # instead.  That produces numbers in the range 0->1 so subtract by 0.5 and
@@ -70,7 +74,7 @@ def get_point_numba(cache=True,):
 # The fastmath=True option to numba.njit can sometimes produce faster
 # code at a SLIGHT loss of numeric precision.
 @timer
-@numba.njit(cache=True, parallel=True)
+@lazy_jit(cache=True, parallel=True)
 def calc_pi_numba(total):
     circle = 0.0
     for i in numba.prange(total):
@@ -80,6 +84,75 @@ def calc_pi_numba(total):
             circle +=1 
     return 4.0 * (circle / total)
 
+
+########################################
+# %% Counter-based random numbers.
+# calc_pi_numba uses numba's global random state, so the result changes
+# from run to run and depends on how prange splits the loop over the
+# threads. A counter-based generator computes random number i directly
+# from (seed, i) with a mixing function, so no state is shared between
+# threads. Here that's SplitMix64: the i-th output is mix(key + i*GOLDEN).
+# The samples are processed in blocks, one block per prange iteration,
+# and block b uses counters 2*start .. 2*(start+n) for its x,y pairs.
+# The in-circle count is an integer sum, so the answer is bit-identical
+# for any number of threads (and any block size).
+
+# Samples per block. Big enough to amortize the prange scheduling,
+# small enough to spread the blocks evenly over the threads.
+COUNTER_BLOCK = 1 << 16
+
+# SplitMix64 constants. Keep them as np.uint64 so numba does all of the
+# arithmetic in unsigned 64-bit integers (mixing in int64 values would
+# turn it into floating point).
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+_TWO = np.uint64(2)
+_ONE = np.uint64(1)
+
+
+@lazy_jit(cache=True)
+def splitmix64(z):
+    z = (z ^ (z >> np.uint64(30))) * _MIX1
+    z = (z ^ (z >> np.uint64(27))) * _MIX2
+    return z ^ (z >> np.uint64(31))
+
+
+@lazy_jit(cache=True)
+def to_unit(z):
+    # Top 53 bits -> a double in [0,1)
+    return np.float64(z >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@lazy_jit(cache=True)
+def count_block(key, start, n):
+    """Count the points in the circle for samples start..start+n-1
+    of the stream given by key. A simple loop of integer math that
+    LLVM can vectorize."""
+    circle = 0
+    base = key + _TWO * np.uint64(start) * _GOLDEN
+    for i in range(n):
+        c = base + _TWO * np.uint64(i) * _GOLDEN
+        x = to_unit(splitmix64(c)) * 2.0 - 1.0
+        y = to_unit(splitmix64(c + _GOLDEN)) * 2.0 - 1.0
+        if x**2 + y**2 <= 1:
+            circle += 1
+    return circle
+
+
+@timer
+@lazy_jit(cache=True, parallel=True)
+def calc_pi_counter(total, seed=0):
+    """calc_pi_numba with a counter-based random number generator.
+    The same seed gives exactly the same result for any thread count."""
+    key = splitmix64(np.uint64(seed))
+    nblocks = (total + COUNTER_BLOCK - 1) // COUNTER_BLOCK
+    counts = np.zeros(nblocks, dtype=np.int64)
+    for b in numba.prange(nblocks):
+        start = b * COUNTER_BLOCK
+        counts[b] = count_block(key, start, min(COUNTER_BLOCK, total - start))
+    return 4.0 * (counts.sum() / total)
+
 #%%
 if __name__=='__main__':
     # Plain numpy implementation 
@@ -99,3 +172,11 @@ if __name__=='__main__':
     numba.set_num_threads(n_cores)
     print(calc_pi_numba(num_iters))
 
+    # The counter-based version gives the same answer for any
+    # number of threads.
+    numba.set_num_threads(1)
+    pi_1 = calc_pi_counter(num_iters, 42)
+    numba.set_num_threads(n_cores)
+    pi_n = calc_pi_counter(num_iters, 42)
+    print(f'Counter RNG: 1 thread {pi_1}, {n_cores} threads {pi_n}, identical: {pi_1 == pi_n}')
+
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Compile the numba kernels ahead of time.
+
+The first call of a numba function compiles it, so the first timed
+call of calc_pi_numba or for_loop is mostly compile time. The kernels
+use cache=True, so the compiled code is saved in __pycache__ and
+later runs load it from there instead - as long as numba, the CPU and
+the source haven't changed. This compiles every kernel listed in
+SIGNATURES for its declared argument types, so the cost is paid once
+(say when a new environment is installed) and not in the first run.
+It reports for each one whether it came from the on-disk cache or had
+to be compiled, and how long that took.
+
+With --run each kernel is also called twice on a small input, and the
+time of the first call is split into the compile time, the time taken
+loading from the cache and the run time (the time of the second call).
+
+To keep the compiled code somewhere permanent, set NUMBA_CACHE_DIR
+before running this and the programs that use the kernels.
+
+Examples:
+    python numba_warmup.py
+    python numba_warmup.py --kernels numba_par.for_loop --run
+
+@author: bgregor
+"""
+
+import os
+
+if "NUMBA_NUM_THREADS" in os.environ:
+    del os.environ["NUMBA_NUM_THREADS"]
+
+import argparse  # noqa: E402
+import importlib  # noqa: E402
+import json  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+# "module.function" -> the numba signatures to compile it for. These
+# are the argument types the tutorial calls them with: Python ints
+# are int64 and the arrays are C-contiguous float64. Arguments left
+# out of a signature are compiled as left out of the call, which numba
+# compiles separately from passing them (see precompile()).
+SIGNATURES = {
+    "numba_pi.calc_pi_numba": ["float64(int64)"],
+    "numba_pi.calc_pi_counter": ["float64(int64)", "float64(int64, int64)"],
+    "numba_par.for_loop": ["void(float64[:, ::1])"],
+}
+
+# Small arguments for --run, as "module.function" -> args.
+SAMPLE_ARGS = {
+    "numba_pi.calc_pi_numba": lambda: (100_000,),
+    "numba_pi.calc_pi_counter": lambda: (100_000, 0),
+    "numba_par.for_loop": lambda: (np.ones((500, 500)),),
+}
+
+
+def get_dispatcher(name):
+    """The numba dispatcher of "module.function", without its @timer."""
+    module, func = name.rsplit(".", 1)
+    func = getattr(importlib.import_module(module), func)
+    return getattr(func, "__wrapped__", func)
+
+
+def cache_counts(dispatcher):
+    """Total (hits, misses) of the on-disk cache for a dispatcher."""
+    stats = dispatcher.stats
+    return sum(stats.cache_hits.values()), sum(stats.cache_misses.values())
+
+
+def call_types(dispatcher, sig):
+    """The argument types a call matching sig dispatches on. Parameters
+    after the ones in sig take their defaults, and numba types those as
+    Omitted(default), so f(n) and f(n, 0) are compiled separately."""
+    import inspect
+
+    from numba import types
+    from numba.core.sigutils import normalize_signature
+
+    arg_types = tuple(normalize_signature(sig)[0])
+    params = list(inspect.signature(dispatcher.py_func).parameters.values())
+    omitted = tuple(types.Omitted(p.default) for p in params[len(arg_types) :])
+    return arg_types + omitted
+
+
+def compile_and_run_times(dispatcher, *args):
+    """Call a numba function twice and split the time of the first call
+    into the time spent compiling, loading code from the on-disk cache
+    (those two are 0 if nothing was compiled or loaded) and running,
+    which is the time of the second call. Returns a dict with
+    "compile", "load", "run", "total" (the first call) and "cache_hit"
+    (True if code was loaded from the on-disk cache)."""
+    from numba.core import event
+
+    hits = cache_counts(dispatcher)[0]
+    # numba fires a "numba:compile" event at the start and the end of
+    # every compilation, including the functions it calls.
+    with event.install_recorder("numba:compile") as rec:
+        start = time.perf_counter()
+        dispatcher(*args)
+        total = time.perf_counter() - start
+    compile_t = 0.0
+    depth = 0
+    for ts, ev in rec.buffer:
+        # Only count the outermost compile, nested ones are inside it.
+        if ev.is_start:
+            if depth == 0:
+                began = ts
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                compile_t += ts - began
+    cache_hit = cache_counts(dispatcher)[0] > hits
+    # Loading from the cache isn't a compile event. Whatever the first
+    # call took over a call with everything in place was spent on it.
+    start = time.perf_counter()
+    dispatcher(*args)
+    run = time.perf_counter() - start
+    load = max(0.0, total - compile_t - run) if cache_hit else 0.0
+    return {
+        "compile": compile_t,
+        "load": load,
+        "run": run,
+        "total": total,
+        "cache_hit": cache_hit,
+    }
+
+
+def precompile(names=None, verbose=True):
+    """Compile the kernels in names (default all of SIGNATURES) for their
+    signatures. Returns a list of dicts with the "kernel", "signature",
+    where the code came from in "source" ("cache", "compiled" or
+    "loaded" if it already was) and the "seconds" it took."""
+    names = list(SIGNATURES) if names is None else names
+    results = []
+    for name in names:
+        dispatcher = get_dispatcher(name)
+        for sig in SIGNATURES[name]:
+            n_sigs = len(dispatcher.signatures)
+            hits = cache_counts(dispatcher)[0]
+            # Compile for the argument types only: the cache is keyed on
+            # exactly what's passed here, and a normal call looks it up
+            # with just the argument types.
+            arg_types = call_types(dispatcher, sig)
+            start = time.perf_counter()
+            dispatcher.compile(arg_types)
+            elapsed = time.perf_counter() - start
+            if len(dispatcher.signatures) == n_sigs:
+                source = "loaded"
+            elif cache_counts(dispatcher)[0] > hits:
+                source = "cache"
+            else:
+                source = "compiled"
+            results.append(
+                {
+                    "kernel": name,
+                    "signature": sig,
+                    "source": source,
+                    "seconds": elapsed,
+                    "cache_path": dispatcher.stats.cache_path,
+                }
+            )
+            if verbose:
+                print(f"{name} {sig}: {source} in {elapsed:.3f} sec")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--kernels", help="comma separated kernel names (default: all)")
+    parser.add_argument("--list", action="store_true", help="list the kernels and exit")
+    parser.add_argument("--run", action="store_true", help="time a first call of each kernel")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, sigs in SIGNATURES.items():
+            print(f"{name:28s} {', '.join(sigs)}")
+        return 0
+    names = args.kernels.split(",") if args.kernels else list(SIGNATURES)
+    unknown = set(names) - set(SIGNATURES)
+    if unknown:
+        parser.error(f"unknown kernels: {', '.join(sorted(unknown))}")
+
+    if args.run:
+        # Call the kernels straight away: any compiling (or cache
+        # loading) happens in the first call and is timed on its own.
+        results = []
+        for name in names:
+            res = compile_and_run_times(get_dispatcher(name), *SAMPLE_ARGS[name]())
+            res["kernel"] = name
+            results.append(res)
+            print(
+                f"{name}: compile {res['compile']:.3f} sec, cache load {res['load']:.3f} sec, "
+                f"run {res['run']:.4f} sec, "
+                f"cache hit: {res['cache_hit']}"
+            )
+    else:
+        results = precompile(names)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
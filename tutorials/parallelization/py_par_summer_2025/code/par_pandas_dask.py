@@ -17,10 +17,8 @@ Pandas and Dask
  
 
 import pandas as pd
-from matplotlib import pyplot as plt
-# seaborn makes matplotlib look better
-import seaborn as sns
-sns.set_theme() 
+# matplotlib, seaborn and dask.distributed are slow to import, they're
+# imported where they're used: plot_histos() and the __main__ section.
 
 from rcs_timer import timer
 from get_n_cores import get_n_cores
@@ -29,15 +27,21 @@ import tempfile
 import urllib.request
 import os
 import time
+import contextlib
+import glob
+import hashlib
+import json
+import shutil
+from collections import Counter
+
+import numpy as np
 
 # Dask datatypes
 import dask.dataframe as dd
-import dask.array as da
 
 # various ways to control Dask
 import dask
-import dask.multiprocessing 
-from dask.distributed import Client,LocalCluster
+from dask.callbacks import Callback
 
 #%%
 # =============================================================================
@@ -76,9 +80,171 @@ def get_bike_data_big():
     print('Done.')   
     return wildcard_csv_files
 
+
+# %%
+def get_bike_data_synthetic(size='2GB', files=None, **settings):
+    """ Make synthetic trip files of any total size (no network needed),
+        see bike_data_gen.py for the settings like seed, skew and
+        member_ratio. They're only made again if the settings change.
+        Returns a wildcard like get_bike_data_big(). """
+    from bike_data_gen import generate
+    files = files if files else get_n_cores()
+    return generate(size=size, files=files, **settings)
+
+
+# %%
+# =============================================================================
+#  A Parquet cache of the CSV files
+# =============================================================================
+# Most of the time proc_data spends is turning CSV text into numbers,
+# and it does that again on every run. ingest() does it once and saves
+# the trips as Parquet: a compressed binary format stored column by
+# column, so reading it back only reads the columns that are asked for
+# and needs no parsing. The station numbers and member type are a few
+# hundred different strings repeated millions of times, so they're
+# stored as categoricals (an integer code per row plus the list of
+# names). A manifest records the size and modification time of every
+# CSV file, and the cache is made again if any of them change.
+
+# The columns proc_data looks at. Start date says when the longest
+# ride happened.
+QUERY_COLUMNS = ['Duration', 'Start date', 'Start station number',
+                 'End station number', 'Member type']
+CATEGORY_COLUMNS = ['Start station number', 'End station number', 'Member type']
+# Bump this when the cache layout changes to invalidate old caches.
+CACHE_VERSION = 1
+MANIFEST = 'manifest.json'
+
+
+def parquet_cache_dir(csv_file):
+    """ The default cache directory for csv_file (a file or a wildcard
+        like get_bike_data_big() returns), in the temp directory. """
+    path_hash = hashlib.sha256(os.path.abspath(csv_file).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'bike_parquet_{path_hash}')
+
+
+def _manifest(sources, columns):
+    files = []
+    for source in sources:
+        stat = os.stat(source)
+        files.append({'path': os.path.abspath(source), 'size': stat.st_size,
+                      'mtime_ns': stat.st_mtime_ns})
+    return {'version': CACHE_VERSION, 'columns': list(columns), 'sources': files}
+
+
+def _read_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _parquet_schema(meta):
+    # The schema dask would work out from the meta gives the categorical
+    # columns the smallest dictionary indices that fit the meta's
+    # categories (int8 for none), and the write fails as soon as a
+    # partition has more than 127 stations. int32 fits any partition.
+    import pyarrow as pa
+    schema = pa.Schema.from_pandas(meta, preserve_index=False)
+    for col in CATEGORY_COLUMNS:
+        if col in schema.names:
+            i = schema.get_field_index(col)
+            schema = schema.set(i, pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+    return schema
+
+
 @timer
-def proc_data(csv_file):
-    df = dd.read_csv(csv_file, dtype={'Zip code': 'object'})
+def ingest(csv_file, cache_dir=None, columns=QUERY_COLUMNS, blocksize='64MB', force=False):
+    """ Convert the CSV file(s) to a Parquet cache, if it isn't up to date
+        already, and return the cache directory. Only columns are kept.
+        The Parquet files are written in parallel, one per partition. """
+    sources = sorted(glob.glob(csv_file))
+    if not sources:
+        raise FileNotFoundError(csv_file)
+    cache_dir = cache_dir or parquet_cache_dir(csv_file)
+    manifest = _manifest(sources, columns)
+    if not force and _read_manifest(cache_dir) == manifest:
+        return cache_dir
+    print(f'Converting {len(sources)} CSV files to Parquet in {cache_dir}')
+    dtype = {col: 'category' for col in CATEGORY_COLUMNS if col in columns}
+    df = dd.read_csv(sources, usecols=columns, dtype=dtype, blocksize=blocksize)
+    # Write to a new directory and swap it in when done, so an
+    # interrupted ingest never leaves a half-written cache. The manifest
+    # goes in last.
+    tmp_dir = cache_dir + '.part'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    try:
+        df.to_parquet(tmp_dir, compression='zstd', write_index=False,
+                      schema=_parquet_schema(df._meta))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return cache_dir
+
+
+def load_trips(data, columns=None, blocksize='64MB'):
+    """ A dask dataframe of trips from CSV file(s) or from a Parquet
+        cache directory made by ingest(). For Parquet only columns are
+        read, for CSV they're all parsed anyway. """
+    if os.path.isdir(data):
+        return dd.read_parquet(data, columns=columns)
+    return dd.read_csv(data, dtype={'Zip code': 'object'}, blocksize=blocksize)
+
+
+# %%
+# =============================================================================
+#  Counting trips per station
+# =============================================================================
+# The station numbers are strings. To count them each partition
+# dictionary-encodes its stations: every different station gets an
+# integer code (pd.factorize, or the codes a categorical column
+# already has) and np.bincount counts the codes in one go. The result
+# for a partition is a table of counts per station with only a few
+# hundred rows, so adding up the tables from all of the partitions
+# is quick and the station numbers don't need to be known in advance.
+
+STATION_COUNTS_META = pd.DataFrame({'start': pd.Series(dtype=np.int64),
+                                    'end': pd.Series(dtype=np.int64)},
+                                   index=pd.Index([], dtype=object))
+
+
+def _encode_counts(stations):
+    # Counts per station of one column of one partition.
+    if isinstance(stations.dtype, pd.CategoricalDtype):
+        codes, names = stations.cat.codes.to_numpy(), stations.cat.categories
+    else:
+        codes, names = pd.factorize(stations)
+    # Missing values have the code -1.
+    counts = np.bincount(codes[codes >= 0], minlength=len(names))
+    return pd.Series(counts, index=pd.Index(names, dtype=object))
+
+
+def _station_counts(part):
+    # The table of start and end counts per station for one partition.
+    counts = pd.concat({'start': _encode_counts(part['Start station number']),
+                        'end': _encode_counts(part['End station number'])}, axis=1)
+    return counts.fillna(0).astype(np.int64)
+
+
+def station_histograms(counts):
+    """ Add up the per partition tables from _station_counts and return
+        the start and end histograms as (counts, ids) tuples. The station
+        ids number the stations in sorted order. """
+    counts = counts.groupby(level=0).sum()
+    ids = np.arange(len(counts))
+    return (counts['start'].to_numpy(), ids), (counts['end'].to_numpy(), ids)
+
+
+@timer
+def proc_data(csv_file, blocksize='64MB'):
+    # csv_file can be a Parquet cache from ingest() too. blocksize is
+    # the size of the CSV partitions.
+    df = load_trips(csv_file, QUERY_COLUMNS, blocksize)
     # Make a filtered dataframe for members only
     df = df[df['Member type']=='Member']    
     
@@ -93,35 +259,156 @@ def proc_data(csv_file):
     print(f'The longest ride row: \n{res}')
     
     # Other processing...
-    # Get the unique station names - convert to a Pandas dataframe
-    # for the assigning of unique numbers.
-    station_names = dd.concat([df['Start station number'],df['End station number']]).unique().compute()
-    station_names = pd.DataFrame(station_names,columns=['name']).reset_index(names='station_id')
-    # Now use a merge to add new columns to the Dask dataframe.
-    station_names = dd.from_pandas(station_names, npartitions=1)
-    
-    # And assign new columns that map the station number to an id number.
-    df['start_id'] = df['Start station number'].replace(station_names.set_index('name')['station_id'])
-    df['end_id'] = df['End station number'].replace(station_names.set_index('name')['station_id'])
-    
-    # Compute a histogram for the start and end id's to see which stations
-    # are the most popular
-    # Dask can compute a histogram using its Array datatype, so convert
-    # those two columns.
-    # oops, we need the number of unique station names to get the # of bins...
-    # convert station_names back to a pandas DF and get the row count.
-    nbins = station_names.compute().shape[0]
-    start_hist = da.histogram(df['start_id'].to_dask_array(), bins=nbins, range=[0,nbins])
-    end_hist = da.histogram(df['end_id'].to_dask_array(), bins=nbins, range=[0,nbins])
-    # start_hist is a tuple: (dask.array, bins numpy array).
-    # Force them to compute so they can be plotted.
-    start_hist =  (start_hist[0].compute(), start_hist[1][0:-1])
-    end_hist =  (end_hist[0].compute(), end_hist[1][0:-1])
+    # Count the trips that start and end at each station, to see which
+    # stations are the most popular. Each partition does its own
+    # counting (see _station_counts) and returns a small table of
+    # counts per station, and the tables are added up here. Both
+    # columns are counted in the same pass over the data.
+    counts = df.map_partitions(_station_counts, meta=STATION_COUNTS_META).compute()
+    start_hist, end_hist = station_histograms(counts)
 
     return start_hist, end_hist
 
 
+# %%
+# =============================================================================
+#  proc_data in one pass
+# =============================================================================
+# Every .compute() in proc_data runs the whole graph from the start, so
+# the CSV files are read and parsed again each time. Here all of the
+# results are planned first and computed together with one
+# dask.compute(), which reads each partition of the files once and
+# shares it between all of the results.
+
+def _longest_rides(part):
+    # The rows with the longest ride in one partition. The longest
+    # overall is the longest of these, so there's no need to find the
+    # max first and then go back over the data to find its rows.
+    return part[part['Duration'] == part['Duration'].max()]
+
+
+@timer
+def proc_data_fused(csv_file, persist=False, blocksize='64MB'):
+    """ Same results as proc_data but computed in a single pass over
+        the data. csv_file can also be a Parquet cache made by ingest().
+        With persist=True the filtered members dataframe is kept in
+        memory (on the workers) for any further calculations. Prints
+        how many times the input was read. """
+    df = load_trips(csv_file, QUERY_COLUMNS, blocksize)
+    # CSV partitions are the same blocks of the files whatever is
+    # computed, so any that weren't read at all can be spotted.
+    npartitions = None if os.path.isdir(csv_file) else df.npartitions
+    # Make a filtered dataframe for members only
+    df = df[df['Member type'] == 'Member']
+    with count_reads() as reads:
+        if persist:
+            df = df.persist()
+        # Plan everything...
+        longest = df.map_partitions(_longest_rides, meta=df._meta)
+        counts = df.map_partitions(_station_counts, meta=STATION_COUNTS_META)
+        # ...and compute it all at once.
+        longest, counts = dask.compute(longest, counts)
+    print(f'Input read: {reads_per_byte(reads, npartitions)}')
+
+    max_ride_val = longest['Duration'].max()
+    print(f'Longest ride: {max_ride_val}')
+    res = longest[longest['Duration'] == max_ride_val]
+    print(f'The longest ride row: \n{res}')
+
+    start_hist, end_hist = station_histograms(counts)
+    return start_hist, end_hist
+
+
+def _is_read(key, task):
+    # Reading tasks are named read-csv-..., read_parquet-..., or with
+    # -fused- when dask combined the read with the next steps, and the
+    # second part of the key is the partition number. A persisted
+    # dataframe's partitions keep the name but are just aliases to the
+    # data in memory, those don't have a function to run.
+    is_read = isinstance(key, tuple) and str(key[0]).startswith('read')
+    return is_read and callable(getattr(task, 'func', None))
+
+
+class _ReadCallback(Callback):
+    # Counts the CSV reading tasks run by the local dask schedulers.
+    def __init__(self, counts):
+        super().__init__()
+        self.counts = counts
+
+    def _posttask(self, key, result, dsk, state, id):
+        if _is_read(key, dsk.get(key)):
+            self.counts[key[1]] += 1
+
+
+def _read_plugin():
+    # The same for dask.distributed, where the tasks are known to the
+    # scheduler. distributed is only imported when it's in use.
+    from dask.distributed import SchedulerPlugin
+
+    class ReadPlugin(SchedulerPlugin):
+        name = 'count-reads'
+
+        def __init__(self):
+            self.counts = Counter()
+
+        async def start(self, scheduler):
+            self.scheduler = scheduler
+
+        def transition(self, key, start, finish, *args, **kwargs):
+            if start == 'processing' and finish == 'memory':
+                ts = self.scheduler.tasks.get(key)
+                if ts is not None and _is_read(key, ts.run_spec):
+                    self.counts[key[1]] += 1
+
+    return ReadPlugin()
+
+
+def _take_read_counts(dask_scheduler):
+    return dict(dask_scheduler.plugins['count-reads'].counts)
+
+
+@contextlib.contextmanager
+def count_reads():
+    """ Context manager that counts how many times each partition of
+        the CSV files is read by the dask calculations inside it. Gives
+        a Counter of partition number -> reads, filled in on exit.
+        Works with the local schedulers and dask.distributed. """
+    counts = Counter()
+    try:
+        from dask.distributed import default_client
+        client = default_client()
+    except (ImportError, ValueError):
+        client = None
+    if client is None:
+        with _ReadCallback(counts):
+            yield counts
+        return
+    client.register_plugin(_read_plugin())
+    try:
+        yield counts
+    finally:
+        counts.update(client.run_on_scheduler(_take_read_counts))
+        client.unregister_scheduler_plugin('count-reads')
+
+
+def reads_per_byte(reads, npartitions=None):
+    """ Describe a count_reads() Counter: every partition is a different
+        part of the input files so this is the number of times each byte
+        was read. Give npartitions to count partitions that weren't read
+        at all, otherwise only the partitions that were are known. """
+    npartitions = npartitions or max(reads, default=-1) + 1
+    times = [reads.get(i, 0) for i in range(npartitions)] or [0]
+    low, high = min(times), max(times)
+    if low == high:
+        return f'each byte read {low} times ({npartitions} partitions)'
+    return f'each byte read {low} to {high} times ({npartitions} partitions)'
+
+
 def plot_histos(start_hist, end_hist):
+    from matplotlib import pyplot as plt
+    # seaborn makes matplotlib look better
+    import seaborn as sns
+    sns.set_theme()
     # A bar plot can be done with Seaborn but the data has to
     # be packed into a Pandas dataframe with the right format.
     nstations = start_hist[0].shape[0]
@@ -136,6 +423,7 @@ if __name__=='__main__':
     # These MUST execute in a __main__ section.  Try varying threads_per_worker
     # and n_workers to see tradeoffs between using threaded, multi-process, and
     # mixed computations.
+    from dask.distributed import Client,LocalCluster
     cluster = LocalCluster(threads_per_worker=2, 
                            n_workers=2)
     client = Client(cluster)
@@ -146,7 +434,9 @@ if __name__=='__main__':
     
     
     # These provide other ways to control Dask without the dask.distributed
-    # library
+    # library. dask_sweep.py times proc_data with each of them, and with
+    # LocalClusters of every n_workers x threads_per_worker split, and
+    # says which is fastest on this machine.
     # Multiprocess parallelism
     #dask.config.set(scheduler='processes', num_workers=get_n_cores()) 
     # Multithreaded parallelism
@@ -165,9 +455,22 @@ if __name__=='__main__':
     csv_file_many = get_bike_data_big()
     # Do some stuff with it.
     print('\n\n**** Processing many CSV ****\n\n')
-    start_hist, end_hist = proc_data(csv_file_many)
+    with count_reads() as reads:
+        start_hist, end_hist = proc_data(csv_file_many)
+    npartitions = dd.read_csv(csv_file_many, dtype={'Zip code': 'object'}).npartitions
+    print(f'proc_data input read: {reads_per_byte(reads, npartitions)}')
     plot_histos(start_hist, end_hist)
 
+    # All of the results in one pass over the data.
+    print('\n\n**** Processing many CSV in one pass ****\n\n')
+    start_hist, end_hist = proc_data_fused(csv_file_many)
+
+    # Convert the CSV files to Parquet once (it's only done again if they
+    # change). Reading that skips the parsing and the unused columns.
+    parquet_dir = ingest(csv_file_many)
+    print('\n\n**** Processing the Parquet cache in one pass ****\n\n')
+    start_hist, end_hist = proc_data_fused(parquet_dir)
+
     # Tell Dask it can close up shop
     client.shutdown()
     client.close()
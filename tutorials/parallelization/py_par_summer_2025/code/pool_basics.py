@@ -12,6 +12,7 @@ value of pi.
 
 # The multiprocessing library
 import multiprocessing as mp
+import time
 
 # numpy for its random number generator
 import numpy
@@ -23,54 +24,177 @@ from get_n_cores import get_n_cores
 # Import a function decorator to time function execution from timer.py
 from rcs_timer import timer
 
+# sample_points() makes its random points in blocks of this size
+# to keep its memory use bounded.
+BLOCK_SIZE = 65536
 
-def sample_points(n):
+
+def sample_points(n, seed=None, block_size=BLOCK_SIZE, verbose=True):
     """Picture a circle of radius 1 inside of a square with sides of length 1.
     Pick 2 random numbers between 0 and 1. In the upper right quadrant, test
     to see if those fall inside the circle.  Repeat, and make a count of the
-    numbers that are inside the circle."""
+    numbers that are inside the circle.
+
+    The points are made with numpy in blocks of block_size points, so the
+    memory used stays the same however large n is. The random numbers are
+    used in the same order as drawing x and y one at a time, so for a given
+    seed the count doesn't depend on block_size."""
     # Print my processor number. This will only work if this runs in a
     # process launched by multiprocessing, so use an "if" to avoid
     # an error in the serial case. This is just for demonstration purposes,
     # there's no real need to
-    if len(mp.current_process()._identity) > 0:
+    if verbose and len(mp.current_process()._identity) > 0:
         print(f"Running on processor {mp.current_process()._identity[0] - 1}")
     n_in = 0
-    # Make a rng generator
-    rng = numpy.random.default_rng()
-    for i in range(n):
-        x = rng.uniform()  # default range is 0-1
-        y = rng.uniform()
-        if x**2 + y**2 < 1.0:
-            n_in += 1
+    # Make a rng generator. The seed can be None, an int, or a
+    # numpy.random.SeedSequence.
+    rng = numpy.random.default_rng(seed)
+    # One buffer for the x,y pairs of a block: x0,y0,x1,y1,...
+    buf = numpy.empty(2 * min(n, block_size))
+    for start in range(0, n, block_size):
+        xy = buf[: 2 * min(block_size, n - start)]
+        rng.random(out=xy)  # default range is 0-1
+        # Square in-place, then add the x**2 and y**2 halves of each pair.
+        numpy.square(xy, out=xy)
+        n_in += int(numpy.count_nonzero(xy[0::2] + xy[1::2] < 1.0))
     return n_in
 
 
 # Serial version:
 @timer
-def serial_calc_pi(N):
+def serial_calc_pi(N, seed=None):
     """Calculate the value of pi"""
-    n_in = sample_points(N)
+    n_in = sample_points(N, seed)
     pi = 4.0 * (n_in / N)
     return pi
 
 
+def _unit_seed(seed_seq, unit):
+    """The random stream of work unit number unit: the same SeedSequence
+    that seed_seq.spawn() would give as its child number unit."""
+    return numpy.random.SeedSequence(seed_seq.entropy, spawn_key=seed_seq.spawn_key + (unit,))
+
+
+def _sample_task(task):
+    """Run sample_points() as a pool task. task is (n, seed_seq, unit):
+    n points made as BLOCK_SIZE point work units numbered from unit,
+    each with its own random stream from seed_seq. Returns n, the
+    in-circle count and the time it took."""
+    n, seed_seq, unit = task
+    start = time.perf_counter()
+    n_in = 0
+    for first in range(0, n, BLOCK_SIZE):
+        n_unit = min(BLOCK_SIZE, n - first)
+        n_in += sample_points(n_unit, _unit_seed(seed_seq, unit), verbose=False)
+        unit += 1
+    return n, n_in, time.perf_counter() - start
+
+
+class PiPool:
+    """A process pool for par_calc_pi() that stays open between calls,
+    so the cost of starting the worker processes is only paid once.
+
+    Instead of one equal chunk per process the work is split into many
+    smaller tasks that are handed out as workers become free, so one
+    slow worker doesn't hold up the whole calculation. The task size
+    comes from the measured time per point: tasks are sized to take
+    about target_task_time seconds, with at least tasks_per_proc tasks
+    per process.
+
+    The points are made in work units of BLOCK_SIZE points, and every
+    unit has its own random stream that depends only on the seed and
+    the unit's position. Tasks are whole numbers of units, so however
+    the work gets split up the count for a given seed is the same.
+
+    Use it as a context manager, or call close() when done:
+
+        with PiPool(4) as pool:
+            pi = par_calc_pi(10_000_000, pool=pool)
+    """
+
+    def __init__(self, nprocs=2, target_task_time=0.05, tasks_per_proc=4):
+        self.nprocs = nprocs
+        self.target_task_time = target_task_time
+        self.tasks_per_proc = tasks_per_proc
+        # Measured points per second in one task. None until the
+        # first tasks have run.
+        self.rate = None
+        self.pool = mp.Pool(processes=nprocs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def task_sizes(self, N):
+        """Split N points into a list of task sizes that add up to N."""
+        # Enough tasks to keep every process busy to the end...
+        size = -(-N // (self.nprocs * self.tasks_per_proc))  # ceiling division
+        # ...but none longer than the target time...
+        if self.rate is not None:
+            size = min(size, int(self.rate * self.target_task_time))
+        # ...and not so small that the cost of sending a task dominates.
+        # Always whole work units.
+        size = max(1, round(size / BLOCK_SIZE)) * BLOCK_SIZE
+        return [size] * (N // size) + ([N % size] if N % size else [])
+
+    def run(self, sizes, seed_seq, unit=0):
+        """Run one task per entry in sizes. The tasks cover consecutive
+        work units starting at unit, so every size except the last has
+        to be a multiple of BLOCK_SIZE. Returns the total in-circle count."""
+        n_in = 0
+        tasks = []
+        for n in sizes:
+            tasks.append((n, seed_seq, unit))
+            unit += -(-n // BLOCK_SIZE)
+        # imap_unordered hands the tasks out one at a time to whichever
+        # worker is free and returns results as they finish.
+        for n, count, elapsed in self.pool.imap_unordered(_sample_task, tasks):
+            n_in += count
+            if elapsed > 0:
+                # Keep a running average of the rate.
+                rate = n / elapsed
+                self.rate = rate if self.rate is None else 0.8 * self.rate + 0.2 * rate
+        return n_in
+
+    def count(self, N, seed=None):
+        """Sample exactly N points across the pool and return the
+        in-circle count. For a given seed the count is always the same,
+        whatever the task sizes turn out to be."""
+        seed_seq = numpy.random.SeedSequence(seed)
+        n_in = 0
+        unit = 0
+        if self.rate is None:
+            # Nothing measured yet. Run one work unit per process to
+            # time them, then size the rest.
+            probe = min(N, self.nprocs * BLOCK_SIZE)
+            sizes = [min(BLOCK_SIZE, probe - i) for i in range(0, probe, BLOCK_SIZE)]
+            n_in += self.run(sizes, seed_seq)
+            unit = len(sizes)
+            N -= probe
+        if N > 0:
+            n_in += self.run(self.task_sizes(N), seed_seq, unit)
+        return n_in
+
+
 # Now let's trying computing this in parallel with a
 # multiprocessing.Pool
 @timer
-def par_calc_pi(N, nprocs=2):
-    num_per_proc = N // nprocs  # integer division
-    # The pool needs an iterable to do parallel calls.
-
-    # Initialize a list of [num_per_proc, num_per_proc,...] etc
-    nums = nprocs * [num_per_proc]
-    # nums will get split up across the worker processes.
-    # Each gets assigned a number N points to generate.
-    total_N = sum(nums)  # account for rounding
-    with mp.Pool(processes=nprocs) as pool:
-        # n_in is the list of in-circle counts per process
-        n_in = pool.map(sample_points, nums, 1)
-    pi = 4.0 * (sum(n_in) / total_N)
+def par_calc_pi(N, nprocs=2, seed=None, pool=None):
+    """Calculate the value of pi in parallel. Pass a PiPool as pool to
+    reuse its processes across calls, otherwise a temporary one with
+    nprocs processes is used."""
+    if pool is None:
+        with PiPool(nprocs) as pool:
+            n_in = pool.count(N, seed)
+    else:
+        n_in = pool.count(N, seed)
+    pi = 4.0 * (n_in / N)
     return pi
 
 
@@ -86,4 +210,11 @@ if __name__ == "__main__":
     # be specified.
     n_cores = get_n_cores()
     pi_par = par_calc_pi(max_N, nprocs=n_cores)
-    print(f"parallel calc pi={pi_par:1.8f}")
+    print(f"parallel calc pi={pi_par:1.8f}\n")
+
+    # Keep one pool open for several calls. Only the first one
+    # pays to start the processes and measure the task size.
+    with PiPool(n_cores) as pool:
+        for i in range(3):
+            pi_par = par_calc_pi(max_N, seed=i, pool=pool)
+            print(f"persistent pool calc pi={pi_par:1.8f}")
@@ -6,11 +6,48 @@ BU RCS Parallel Python Tutorial
 A function decorator that prints the execution time
 of a function.
 
+The decorator also has an opt-in benchmarking mode. When it's
+turned on (with set_benchmark_mode() or the benchmark_mode()
+context manager) every decorated call runs some warmup calls and
+then N timed repeats, prints min/median/p95/stddev, and stores a
+record in an in-process registry that can be exported to JSON or
+CSV with export_records().
+
 @author: bgregor
 """
 
-import time
+import contextlib
 import functools
+import statistics
+import threading
+import time
+
+# Benchmark mode settings. This is a plain dict so the check in the
+# decorator is a single lookup when the mode is off.
+_BENCH = {"enabled": False, "warmup": 1, "repeats": 5, "label": None, "quiet": False}
+
+# The registry of benchmark records, one dict per benchmarked call.
+_RECORDS = []
+
+# Used to stop a benchmarked function from re-benchmarking any
+# decorated functions that it calls.
+_ACTIVE = threading.local()
+
+# Columns written by export_records() for CSV files.
+CSV_FIELDS = [
+    "name",
+    "label",
+    "warmup",
+    "repeats",
+    "first",
+    "min",
+    "median",
+    "mean",
+    "p95",
+    "max",
+    "stddev",
+    "timestamp",
+]
 
 
 # A decorator that does simple function timing.
@@ -21,6 +58,14 @@ def timer(func):
         handle doc strings and function names.'''
     @functools.wraps(func)
     def timing_wrapper(*args, **kwargs):
+        # Calls made from inside a benchmarked function just run
+        # quietly. In benchmark mode hand the call over to benchmark().
+        if getattr(_ACTIVE, "running", False):
+            return func(*args, **kwargs)
+        if _BENCH["enabled"]:
+            # The caller's kwargs go through untouched, even ones
+            # named warmup, repeats or label.
+            return _benchmark(func, args, kwargs, None, None, None)
         # *args and **kwargs allow for variable numbers of
         # arguments
         start_t = time.perf_counter()
@@ -32,3 +77,154 @@ def timer(func):
         print(f'{func.__name__}: {end_t - start_t:.3f} sec')
         return result
     return timing_wrapper
+
+
+def set_benchmark_mode(enabled=True, warmup=1, repeats=5, label=None, quiet=False):
+    """Turn the benchmarking mode of @timer on or off.
+
+    warmup: number of untimed calls before the timed ones. The first
+            call of a numba function includes its JIT compile time,
+            so keep this at 1 or more for numba kernels.
+    repeats: number of timed calls.
+    label: an optional string stored with every record, e.g. a
+           problem size or a release tag.
+    quiet: don't print the summary line for each call.
+
+    Note that every warmup and repeat call runs the function again,
+    so functions that modify their arguments in-place (like
+    numba_par.np_auto) will see the modified data.
+    """
+    if warmup < 0 or repeats < 1:
+        raise ValueError("warmup must be >= 0 and repeats must be >= 1")
+    _BENCH.update(enabled=enabled, warmup=warmup, repeats=repeats, label=label, quiet=quiet)
+
+
+@contextlib.contextmanager
+def benchmark_mode(warmup=1, repeats=5, label=None, quiet=False):
+    """Context manager version of set_benchmark_mode(). The previous
+    settings are restored on exit."""
+    saved = dict(_BENCH)
+    set_benchmark_mode(True, warmup=warmup, repeats=repeats, label=label, quiet=quiet)
+    try:
+        yield _RECORDS
+    finally:
+        _BENCH.update(saved)
+
+
+def summarize(times):
+    """Return a dict of min/median/mean/p95/max/stddev for a list
+    of elapsed times in seconds."""
+    if len(times) > 1:
+        # 'inclusive' keeps p95 inside the range of measured values.
+        p95 = statistics.quantiles(times, n=20, method="inclusive")[-1]
+        stddev = statistics.stdev(times)
+    else:
+        p95 = times[0]
+        stddev = 0.0
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "p95": p95,
+        "max": max(times),
+        "stddev": stddev,
+    }
+
+
+def benchmark(func, *args, warmup=None, repeats=None, label=None, **kwargs):
+    """Call func(*args, **kwargs) warmup + repeats times, store a
+    record of the timings in the registry and return the result of
+    the last call. Unset warmup/repeats/label come from the current
+    benchmark mode settings."""
+    return _benchmark(func, args, kwargs, warmup, repeats, label)
+
+
+def _benchmark(func, args, kwargs, warmup, repeats, label):
+    warmup = _BENCH["warmup"] if warmup is None else warmup
+    repeats = _BENCH["repeats"] if repeats is None else repeats
+    label = _BENCH["label"] if label is None else label
+    # A numba dispatcher lists its compiled signatures, so we can tell
+    # whether the first call had to compile anything.
+    n_sigs = len(getattr(func, "signatures", ()))
+    n_hits = _cache_hits(func)
+    warmup_times = []
+    times = []
+    # benchmark() can be called from inside a benchmarked function, so
+    # put the guard back the way it was afterwards.
+    was_running = getattr(_ACTIVE, "running", False)
+    _ACTIVE.running = True
+    try:
+        for i in range(warmup + repeats):
+            start_t = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start_t
+            if i < warmup:
+                warmup_times.append(elapsed)
+            else:
+                times.append(elapsed)
+    finally:
+        _ACTIVE.running = was_running
+
+    record = {
+        "name": getattr(func, "__qualname__", getattr(func, "__name__", repr(func))),
+        "module": getattr(func, "__module__", None),
+        "label": label,
+        "warmup": warmup,
+        "repeats": repeats,
+        # The very first call, which includes any one-time costs.
+        "first": (warmup_times or times)[0],
+        "timestamp": time.time(),
+        "warmup_times": warmup_times,
+        "times": times,
+    }
+    record.update(summarize(times))
+    if hasattr(func, "signatures"):
+        record["compiled"] = len(func.signatures) > n_sigs
+        # Compiled code loaded from the on-disk cache (cache=True) is
+        # much cheaper than compiling. See numba_warmup.py.
+        record["cache_hit"] = _cache_hits(func) > n_hits
+    _RECORDS.append(record)
+
+    if not _BENCH["quiet"]:
+        print(
+            f"{record['name']}: min {record['min']:.3f} median {record['median']:.3f} "
+            f"p95 {record['p95']:.3f} stddev {record['stddev']:.3f} sec "
+            f"({repeats} runs, {warmup} warmup)"
+        )
+    return result
+
+
+def _cache_hits(func):
+    # Number of times a numba dispatcher loaded code from its cache.
+    stats = getattr(func, "stats", None)
+    return sum(stats.cache_hits.values()) if hasattr(stats, "cache_hits") else 0
+
+
+def get_records():
+    """Return a copy of the list of benchmark records."""
+    return list(_RECORDS)
+
+
+def clear_records():
+    """Empty the benchmark registry."""
+    _RECORDS.clear()
+
+
+def export_records(filename, records=None):
+    """Write the benchmark records to filename. A .csv extension
+    writes one row per record with the CSV_FIELDS columns, anything
+    else writes the full records as JSON."""
+    records = _RECORDS if records is None else records
+    if str(filename).endswith(".csv"):
+        import csv
+
+        with open(filename, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        import json
+
+        with open(filename, "w") as f:
+            json.dump(records, f, indent=2)
+    return filename
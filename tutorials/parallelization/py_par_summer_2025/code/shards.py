@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Lazy data sources that the workers make for themselves.
+
+Making np.arange(0, 100_000_000) in the parent costs 800 MB before any
+work starts, and then it all has to be sent to the workers. If the
+data can be described instead of stored - a range of integers, a
+stream of random numbers, a piece of a file - the parent only needs
+to send a tiny "shard" description to each worker. The worker expands
+its shard a block at a time, with blocks small enough to stay in the
+CPU cache, so no process ever holds the whole thing.
+
+    shards = range_shards(0, 10_000_000_000, 64)
+    total = shard_reduce(sum_nums, operator.add, shards, ncores, initial=0)
+
+runs in the same parent memory for ten billion numbers as for ten.
+
+@author: bgregor
+"""
+
+import functools
+import operator
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from map_reduce import map_reduce
+
+# Elements per block. 64K int64/float64 values is 512 KB, which fits in
+# the L2 cache of most CPUs.
+BLOCK_SIZE = 1 << 16
+
+
+class RangeShard(namedtuple("RangeShard", ["start", "stop", "step", "dtype"])):
+    """The numbers np.arange(start, stop, step, dtype) would make."""
+
+    __slots__ = ()
+
+    # Not __len__: tuple() uses that as a size hint, so pickling a
+    # shard would allocate a slot for every number in it.
+    @property
+    def size(self):
+        return max(0, -(-(self.stop - self.start) // self.step))
+
+    def blocks(self, block_size=BLOCK_SIZE):
+        for first in range(0, self.size, block_size):
+            n = min(block_size, self.size - first)
+            lo = self.start + first * self.step
+            yield np.arange(lo, lo + n * self.step, self.step, dtype=self.dtype)[:n]
+
+
+class RandomShard(namedtuple("RandomShard", ["n", "seed"])):
+    """n uniform random numbers in [0, 1) from a numpy.random.SeedSequence.
+    The numbers don't depend on the block size."""
+
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return self.n
+
+    def blocks(self, block_size=BLOCK_SIZE):
+        rng = np.random.default_rng(self.seed)
+        for first in range(0, self.n, block_size):
+            yield rng.random(min(block_size, self.n - first))
+
+
+class FileShard(namedtuple("FileShard", ["filename", "start", "stop"])):
+    """Bytes start..stop of a file, as uint8 arrays."""
+
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return self.stop - self.start
+
+    def blocks(self, block_size=BLOCK_SIZE):
+        with open(self.filename, "rb") as f:
+            f.seek(self.start)
+            for first in range(0, self.size, block_size):
+                data = f.read(min(block_size, self.size - first))
+                if not data:
+                    return
+                yield np.frombuffer(data, dtype=np.uint8)
+
+
+def range_shards(start, stop, nshards, step=1, dtype=np.int64):
+    """Split np.arange(start, stop, step) into about nshards RangeShards."""
+    n = RangeShard(start, stop, step, dtype).size
+    size = max(1, -(-n // nshards))
+    return [
+        RangeShard(start + i * step, start + min(i + size, n) * step, step, dtype)
+        for i in range(0, n, size)
+    ]
+
+
+def random_shards(n, nshards, seed=None):
+    """Split n random numbers into about nshards RandomShards, each with
+    its own independent stream spawned from seed."""
+    size = max(1, -(-n // nshards))
+    sizes = [min(size, n - i) for i in range(0, n, size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    return [RandomShard(k, s) for k, s in zip(sizes, seeds)]
+
+
+def file_shards(filename, nshards, at_lines=True):
+    """Split a file into about nshards FileShards. With at_lines the
+    shards start and end at line breaks (see letter_freq.split_ranges)."""
+    if at_lines:
+        from letter_freq import split_ranges
+
+        return [FileShard(filename, a, b) for a, b in split_ranges(filename, nshards)]
+    size = os.path.getsize(filename)
+    step = max(1, -(-size // nshards))
+    return [FileShard(filename, a, min(a + step, size)) for a in range(0, size, step)]
+
+
+def reduce_shard(task):
+    """Pool task: expand a shard block by block, call func on each
+    block and combine the results. task is (func, combine, shard,
+    block_size)."""
+    func, combine, shard, block_size = task
+    return functools.reduce(combine, map(func, shard.blocks(block_size)))
+
+
+def shard_reduce(
+    func, combine, shards, ncores=None, initial=None, block_size=BLOCK_SIZE, pool=None
+):
+    """combine the results of func on every block of every shard, with
+    the shards spread over a pool (see map_reduce.py). func and combine
+    have to be top level functions so they can be sent to the workers."""
+    tasks = [(func, combine, shard, block_size) for shard in shards if shard.size]
+    return map_reduce(reduce_shard, combine, tasks, ncores, initial, pool=pool)
+
+
+if __name__ == "__main__":
+    import time
+
+    from get_n_cores import get_n_cores
+
+    ncores = get_n_cores()
+    N = 1_000_000_000
+    start = time.perf_counter()
+    total = shard_reduce(np.sum, operator.add, range_shards(0, N, 16 * ncores), ncores, 0)
+    print(f"sum(range({N:,})) = {total}: {time.perf_counter() - start:.2f} sec")
+    print(f"  check: {total == N * (N - 1) // 2}")
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Share a numpy array with pool workers without copying it.
+
+pool.map(func, np.array_split(nums, n)) pickles every slice, sends it
+down a pipe and unpickles it in the worker: the whole array is copied
+twice and the parent holds the pickled bytes while it does it. Here
+the array is copied once into a multiprocessing.shared_memory segment
+and the workers are only sent small ArrayDesc tuples of
+(name, dtype, shape, offset). attach() turns a descriptor back into a
+numpy view of the shared segment, no copy at all.
+
+    with SharedArray.from_array(nums) as shared:
+        partial_sums = pool.map(sum_shared, shared.split(100))
+
+The parent owns the segment and unlinks it when the with block ends,
+also when a worker raised an error or died. If the parent itself is
+killed, the multiprocessing resource tracker removes the segment.
+
+@author: bgregor
+"""
+
+import atexit
+import math
+import weakref
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Everything a worker needs to find a piece of a shared array. offset
+# is in bytes from the start of the segment.
+ArrayDesc = namedtuple("ArrayDesc", ["name", "dtype", "shape", "offset"])
+
+# Segments this process has attached to, by name. A segment stays open
+# while the views handed out may be in use, so a pool worker attaches
+# only once however many tasks it gets for the same array. Attaching a
+# different segment closes the ones nothing uses any more: a long-lived
+# worker would otherwise keep every array it was ever sent mapped.
+_ATTACHED = {}
+
+
+def _unlink(shm):
+    # Called when a SharedArray is closed, garbage collected, or at exit.
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedArray:
+    """A numpy array in a shared memory segment owned by this process."""
+
+    def __init__(self, shape, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape) if np.iterable(shape) else (shape,)
+        nbytes = math.prod(self.shape) * self.dtype.itemsize
+        # A segment can't be 0 bytes.
+        self._shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        self.name = self._shm.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        # Unlink the segment even if close() is never called.
+        self._finalizer = weakref.finalize(self, _unlink, self._shm)
+
+    @classmethod
+    def from_array(cls, arr):
+        """Copy an array into a new shared segment."""
+        arr = np.asarray(arr)
+        shared = cls(arr.shape, arr.dtype)
+        shared.array[...] = arr
+        return shared
+
+    def desc(self, start=0, stop=None):
+        """Descriptor of rows start:stop (along the first axis)."""
+        stop = self.shape[0] if stop is None else stop
+        row_bytes = self.dtype.itemsize * math.prod(self.shape[1:])
+        return ArrayDesc(
+            self.name, self.dtype.str, (stop - start,) + self.shape[1:], start * row_bytes
+        )
+
+    def split(self, sections):
+        """Descriptors for sections pieces along the first axis, the
+        same pieces np.array_split would make."""
+        nrows = self.shape[0]
+        size, extra = divmod(nrows, sections)
+        bounds = [0]
+        for i in range(sections):
+            bounds.append(bounds[-1] + size + (i < extra))
+        return [self.desc(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def close(self):
+        """Release and unlink the segment. Workers that still have it
+        attached keep their views until they exit."""
+        # Drop our view first, a segment can't be closed while a
+        # numpy array still uses its buffer.
+        self.array = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _open(name):
+    # Python 3.13+ can be told not to track a segment we don't own.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Before that every attach registers the segment with a resource
+    # tracker. A worker forked before the parent's tracker was started
+    # gets a tracker of its own, which "cleans up" the parent's segment
+    # when the worker exits. So skip the registration.
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def attach(desc):
+    """Return a numpy view of the piece of a shared array that desc
+    describes. Meant to be called in a worker process."""
+    shm = _ATTACHED.get(desc.name)
+    if shm is None:
+        _close_unused()
+        shm = _ATTACHED[desc.name] = _open(desc.name)
+    count = math.prod(desc.shape)
+    arr = np.frombuffer(shm.buf, dtype=desc.dtype, count=count, offset=desc.offset)
+    return arr.reshape(desc.shape)
+
+
+def _close_unused():
+    # Close the attached segments that no view uses. Closing one that's
+    # still in use raises BufferError, those stay open.
+    for name, shm in list(_ATTACHED.items()):
+        try:
+            shm.close()
+        except BufferError:
+            continue
+        del _ATTACHED[name]
+
+
+def detach_all():
+    """Forget every attached segment. Views from attach() must not be
+    used after this."""
+    for shm in _ATTACHED.values():
+        try:
+            shm.close()
+        except BufferError:
+            # A view is still alive somewhere, the OS cleans up at exit.
+            pass
+    _ATTACHED.clear()
+
+
+atexit.register(detach_all)
+
+
+# Worker functions for the example below. They have to be at the top
+# level of the module so spawned workers can find them.
+def total(piece):
+    return int(piece.sum())
+
+
+def total_shared(desc):
+    return total(attach(desc))
+
+
+if __name__ == "__main__":
+    import multiprocessing as mp
+    import pickle
+    import time
+
+    from get_n_cores import get_n_cores
+
+    ncores = get_n_cores()
+    nums = np.arange(50_000_000, dtype=np.int64)
+    with mp.Pool(ncores) as pool:
+        start = time.perf_counter()
+        pieces = np.array_split(nums, 100)
+        copied = sum(pool.map(total, pieces))
+        sent = sum(len(pickle.dumps(p)) for p in pieces)
+        print(f"pickled slices: {time.perf_counter() - start:.3f} sec, {sent / 1e6:.1f} MB sent")
+
+        start = time.perf_counter()
+        with SharedArray.from_array(nums) as shared:
+            descs = shared.split(100)
+            shared_total = sum(pool.map(total_shared, descs))
+        sent = sum(len(pickle.dumps(d)) for d in descs)
+        print(f"shared memory: {time.perf_counter() - start:.3f} sec, {sent / 1e6:.4f} MB sent")
+    print(f"Same sum: {copied == shared_total}")
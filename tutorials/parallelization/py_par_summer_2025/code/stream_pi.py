@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Calculate pi until it's accurate enough, instead of for a fixed
+number of points.
+
+calc_pi_numpy and par_calc_pi are given the number of points up front.
+Here worker processes keep making batches of points with
+pool_basics.sample_points and the parent keeps a running mean and
+variance of the estimate. It stops as soon as the standard error is
+below a target, a time budget runs out, or a maximum number of points
+is reached. Only a few batches are in flight at any time, so memory
+stays flat however long it runs.
+
+@author: bgregor
+"""
+
+import math
+import multiprocessing as mp
+import queue
+import statistics
+import time
+
+import numpy
+
+from get_n_cores import get_n_cores
+from pool_basics import BLOCK_SIZE, PiPool, sample_points
+
+# Points per batch. About 10 ms of work per batch.
+BATCH_SIZE = 16 * BLOCK_SIZE
+
+
+class RunningStats:
+    """Running mean and variance of a stream of values, updated a batch
+    at a time with the parallel form of Welford's algorithm (Chan et
+    al.), so the values themselves never have to be kept."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+
+    def add_batch(self, n, mean, m2):
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta**2 * self.n * n / total
+        self.n = total
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else math.inf
+
+    @property
+    def stderr(self):
+        return math.sqrt(self.variance / self.n) if self.n > 0 else math.inf
+
+
+def _batch_stats(n, n_in):
+    """Mean and sum of squared differences for a batch of n samples of
+    4*(point is in the circle), of which n_in were in the circle."""
+    mean = 4.0 * n_in / n
+    # The samples are either 4 or 0.
+    m2 = n_in * (4.0 - mean) ** 2 + (n - n_in) * mean**2
+    return mean, m2
+
+
+def stream_calc_pi(
+    target_se=None,
+    time_budget=None,
+    max_samples=None,
+    batch_size=BATCH_SIZE,
+    nprocs=2,
+    seed=None,
+    pool=None,
+    confidence=0.95,
+):
+    """Estimate pi until one of the stopping conditions is met:
+
+    target_se: the standard error of the estimate is at or below this.
+    time_budget: this many seconds have passed.
+    max_samples: this many points have been sampled.
+
+    At least one has to be given. Batches of batch_size points are made
+    by nprocs worker processes (or by a PiPool passed as pool). With
+    nprocs=1 everything runs in this process. The conditions are checked
+    after every batch, so time_budget can be passed by up to the time
+    of one batch (about 10 ms with the default batch_size).
+
+    Returns a dict with the estimate "pi", its "stderr", the
+    "confidence" interval "ci", the number of "samples" and "batches"
+    used, the "elapsed" time and the "reason" it stopped.
+    """
+    if target_se is None and time_budget is None and max_samples is None:
+        raise ValueError("Give at least one of target_se, time_budget or max_samples")
+    if max_samples is not None and max_samples < 1:
+        raise ValueError("max_samples must be >= 1")
+    if batch_size < 1:
+        raise ValueError("batch_size must be >= 1")
+    start_t = time.perf_counter()
+    seed_seq = numpy.random.SeedSequence(seed)
+    stats = RunningStats()
+    batches = 0
+
+    def done():
+        # Need at least 2 batches before trusting the standard error.
+        if target_se is not None and batches >= 2 and stats.stderr <= target_se:
+            return "target_se"
+        if time_budget is not None and time.perf_counter() - start_t >= time_budget:
+            return "time_budget"
+        if max_samples is not None and stats.n >= max_samples:
+            return "max_samples"
+        return None
+
+    def next_size(submitted):
+        # Batch size, trimmed so max_samples is never overshot.
+        if max_samples is None:
+            return batch_size
+        return max(0, min(batch_size, max_samples - submitted))
+
+    reason = None
+    if pool is None and nprocs == 1:
+        submitted = 0
+        while reason is None:
+            n = next_size(submitted)
+            submitted += n
+            n_in = sample_points(n, seed_seq.spawn(1)[0], verbose=False)
+            stats.add_batch(n, *_batch_stats(n, n_in))
+            batches += 1
+            reason = done()
+    else:
+        own_pool = pool is None
+        mp_pool = mp.Pool(nprocs) if own_pool else pool.pool
+        nprocs = nprocs if own_pool else pool.nprocs
+        # Results come back through a queue from the apply_async callbacks.
+        results = queue.Queue()
+        in_flight = 0
+        submitted = 0
+        try:
+            # Keep two batches per process in flight so no worker waits
+            # on the parent, but never more.
+            while reason is None:
+                while in_flight < 2 * nprocs and next_size(submitted) > 0:
+                    n = next_size(submitted)
+                    mp_pool.apply_async(
+                        sample_points,
+                        (n, seed_seq.spawn(1)[0]),
+                        {"verbose": False},
+                        callback=lambda n_in, n=n: results.put((n, n_in)),
+                        error_callback=lambda err: results.put(err),
+                    )
+                    submitted += n
+                    in_flight += 1
+                if in_flight == 0:
+                    # Nothing left to submit or wait for.
+                    reason = done() or "max_samples"
+                    break
+                res = results.get()
+                in_flight -= 1
+                if isinstance(res, BaseException):
+                    raise res
+                stats.add_batch(res[0], *_batch_stats(*res))
+                batches += 1
+                reason = done()
+            # The batches still running are already paid for: use them,
+            # unless the time is up. Then they're dropped: an own pool
+            # is terminated below, a shared one finishes them in the
+            # background and their results go nowhere.
+            while in_flight > 0 and reason != "time_budget":
+                res = results.get()
+                in_flight -= 1
+                if not isinstance(res, BaseException):
+                    stats.add_batch(res[0], *_batch_stats(*res))
+                    batches += 1
+        finally:
+            if own_pool:
+                mp_pool.terminate()
+                mp_pool.join()
+
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    half_width = z * stats.stderr
+    return {
+        "pi": stats.mean,
+        "stderr": stats.stderr,
+        "confidence": confidence,
+        "ci": (stats.mean - half_width, stats.mean + half_width),
+        "samples": stats.n,
+        "batches": batches,
+        "elapsed": time.perf_counter() - start_t,
+        "reason": reason,
+    }
+
+
+if __name__ == "__main__":
+    n_cores = get_n_cores()
+    # Stop at 4 correct digits or 10 seconds, whichever comes first.
+    res = stream_calc_pi(target_se=1e-4, time_budget=10.0, nprocs=n_cores, seed=42)
+    print(
+        f"pi = {res['pi']:.6f} +/- {res['stderr']:.2e}, 95% CI [{res['ci'][0]:.6f}, {res['ci'][1]:.6f}]"
+    )
+    print(
+        f"{res['samples']:,} points in {res['batches']} batches, {res['elapsed']:.2f} sec ({res['reason']})"
+    )
+
+    # The same thing with a pool that stays open.
+    with PiPool(n_cores) as pool:
+        for se in (1e-3, 3e-4):
+            res = stream_calc_pi(target_se=se, pool=pool)
+            print(f"target {se:.0e}: pi = {res['pi']:.6f} from {res['samples']:,} points")
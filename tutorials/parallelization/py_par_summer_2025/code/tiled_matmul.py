@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Multiply matrices that don't fit in memory.
+
+x @ y needs x, y and the result in RAM all at once. Here the matrices
+are np.memmap arrays in files on disk and the result is computed one
+tile at a time:
+
+    out[i, j] = sum over p of a[i, p] @ b[p, j]
+
+where every a[i, p], b[p, j] and out[i, j] is a tile small enough that
+all of the tiles being worked on fit in a memory budget. The tile
+products run on a pool of threads - numpy's matrix multiply releases
+the GIL, so threads run them in parallel - with BLAS itself held to
+one thread each so the two don't fight over the cores.
+
+The memory used is about the budget however big the matrices are.
+The pages of the files that were read stay in the OS page cache, but
+the OS can drop those whenever it needs the memory.
+
+@author: bgregor
+"""
+
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import threadpoolctl
+
+# Default memory budget for the tiles, in bytes.
+MEMORY_BUDGET = 256 * 2**20
+
+
+def blas_threads():
+    """The number of threads the BLAS library may use right now."""
+    counts = [info["num_threads"] for info in threadpoolctl.threadpool_info()]
+    return max(counts) if counts else 1
+
+
+def tile_size(m, k, n, itemsize, memory_budget=MEMORY_BUDGET, nthreads=1):
+    """Square tile size t so that every thread's tiles fit in the budget.
+    Each thread holds a t x t tile of a, of b, of the result and a
+    temporary for the product, so 4 t*t items."""
+    t = int(math.sqrt(memory_budget / (4 * itemsize * nthreads)))
+    if t < 1:
+        raise ValueError(f"memory_budget of {memory_budget} bytes is too small")
+    return min(t, max(m, k, n))
+
+
+def open_memmap(filename, shape, dtype=np.float64, mode="w+"):
+    """A memory-mapped .npy file. mode='w+' makes a new one, 'r' or 'r+'
+    opens an existing one (shape and dtype then come from the file)."""
+    if mode == "w+":
+        return np.lib.format.open_memmap(filename, mode=mode, dtype=dtype, shape=tuple(shape))
+    return np.lib.format.open_memmap(filename, mode=mode)
+
+
+def random_memmap(filename, shape, dtype=np.float64, seed=None, block_rows=1024):
+    """A memory-mapped .npy file of random numbers in [0, 1), written
+    block_rows rows at a time so it never has to fit in memory."""
+    out = open_memmap(filename, shape, dtype)
+    rng = np.random.default_rng(seed)
+    for i in range(0, shape[0], block_rows):
+        rows = out[i : i + block_rows]
+        rows[:] = rng.random(rows.shape)
+    out.flush()
+    return out
+
+
+def _tile_product(a, b, out, rows, cols, t):
+    # One tile of the result: sum the tile products along k.
+    k = a.shape[1]
+    acc = None
+    for p in range(0, k, t):
+        # Copy the tiles into memory, BLAS wants contiguous arrays.
+        a_tile = np.ascontiguousarray(a[rows, p : p + t])
+        b_tile = np.ascontiguousarray(b[p : p + t, cols])
+        if acc is None:
+            acc = a_tile @ b_tile
+        else:
+            acc += a_tile @ b_tile
+    out[rows, cols] = acc
+
+
+def tiled_matmul(a, b, out=None, memory_budget=MEMORY_BUDGET, nthreads=None, tile=None):
+    """Compute a @ b one tile at a time. a, b and out can be numpy
+    arrays or np.memmaps. out is made in memory if it isn't given.
+
+    memory_budget: bytes for all of the tiles in use at once.
+    nthreads: threads computing tiles, by default the number of
+              threads BLAS is currently allowed.
+    tile: the tile size, by default the largest that fits the budget.
+    Returns out.
+    """
+    m, k = a.shape
+    k2, n = b.shape
+    if k != k2:
+        raise ValueError(f"shapes {a.shape} and {b.shape} don't match")
+    dtype = np.result_type(a.dtype, b.dtype)
+    if out is None:
+        out = np.empty((m, n), dtype=dtype)
+    nthreads = blas_threads() if nthreads is None else nthreads
+    t = tile or tile_size(m, k, n, dtype.itemsize, memory_budget, nthreads)
+    tiles = [(slice(i, i + t), slice(j, j + t)) for i in range(0, m, t) for j in range(0, n, t)]
+    # Each tile product gets one BLAS thread, the pool provides the
+    # parallelism.
+    with threadpoolctl.threadpool_limits(limits=1, user_api="blas"):
+        with ThreadPoolExecutor(max_workers=nthreads) as pool:
+            # list() so any exception in a thread is raised here.
+            list(pool.map(lambda rc: _tile_product(a, b, out, rc[0], rc[1], t), tiles))
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+if __name__ == "__main__":
+    import time
+    import tracemalloc
+
+    from get_n_cores import get_n_cores
+
+    SIZE = 6000
+    BUDGET = 64 * 2**20
+    nthreads = get_n_cores()
+    with tempfile.TemporaryDirectory() as tmp:
+        x = random_memmap(os.path.join(tmp, "x.npy"), (SIZE, SIZE), seed=1)
+        y = random_memmap(os.path.join(tmp, "y.npy"), (SIZE, SIZE), seed=2)
+        z = open_memmap(os.path.join(tmp, "z.npy"), (SIZE, SIZE))
+        print(f"Matrices of {SIZE * SIZE * 8 / 2**20:.0f} MB each, budget {BUDGET / 2**20:.0f} MB")
+        # numpy reports its allocations to tracemalloc, the mapped
+        # file pages aren't allocations so they don't count.
+        tracemalloc.start()
+        start = time.perf_counter()
+        tiled_matmul(x, y, z, memory_budget=BUDGET, nthreads=nthreads)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"tiled_matmul with {nthreads} threads: {elapsed:.2f} sec")
+        print(f"Peak memory allocated: {peak / 2**20:.0f} MB")
+        # Spot check a few rows against the in-memory multiply.
+        rows = np.asarray(x[:10]) @ np.asarray(y)
+        print(f"Same result: {np.allclose(rows, z[:10])}")
+        del x, y, z
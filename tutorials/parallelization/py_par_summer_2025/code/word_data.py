@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BU RCS Parallel Python Tutorial
+
+Get the 1M word file for the my_pool examples.
+
+The word file from SuperFastPython is downloaded once, streamed to
+disk, unzipped into a cache directory and checksummed. Later runs
+just use the cached file. A local file (plain text or the zip) can be
+given instead, or a synthetic corpus of any size can be made for
+offline benchmarking. The words can then be read in fixed-size
+batches so memory use doesn't grow with the file.
+
+The cache directory is $RCS_DATA_DIR if that's set, otherwise a
+folder in the temp directory.
+
+@author: bgregor
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+from zipfile import ZipFile
+
+WORDS_URL = "https://raw.githubusercontent.com/SuperFastPython/DataSets/main/bin/1m_words.txt.zip"
+WORDS_MEMBER = "1m_words.txt"
+
+# Words per batch from iter_word_batches()
+BATCH_SIZE = 100_000
+
+
+def cache_dir():
+    """The directory used to cache the data files."""
+    path = os.environ.get("RCS_DATA_DIR", os.path.join(tempfile.gettempdir(), "rcs_tutorial_data"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_sha256(filename):
+    """sha256 of a file, read 1 MB at a time."""
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _sidecar(filename):
+    return filename + ".sha256.json"
+
+
+def _source_info(source):
+    stat = os.stat(source)
+    return {"path": os.path.abspath(source), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _write_checksum(filename, source=None):
+    stat = os.stat(filename)
+    info = {"sha256": file_sha256(filename), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if source is not None:
+        # Remember what the file was made from, see is_cached().
+        info["source"] = _source_info(source)
+    with open(_sidecar(filename), "w") as f:
+        json.dump(info, f)
+    return info
+
+
+def is_cached(filename, verify=False, source=None):
+    """True if filename exists and matches its checksum file. Normally
+    only the size and modification time are compared, which takes no
+    time at all. verify=True recomputes the sha256 as well. If the
+    file was made from a source file (a local zip), that has to be the
+    same file, unchanged, too."""
+    try:
+        with open(_sidecar(filename)) as f:
+            info = json.load(f)
+        stat = os.stat(filename)
+        if source is not None and info.get("source") != _source_info(source):
+            return False
+    except (OSError, ValueError):
+        return False
+    if (stat.st_size, stat.st_mtime_ns) != (info["size"], info["mtime_ns"]):
+        return False
+    return not verify or file_sha256(filename) == info["sha256"]
+
+
+def _extract(zip_file, out_file, source=None):
+    # Stream the text file out of the archive into a temp file, then
+    # rename so a half-written file is never mistaken for the cache.
+    with ZipFile(zip_file) as myzip:
+        names = myzip.namelist()
+        member = WORDS_MEMBER if WORDS_MEMBER in names else names[0]
+        src = myzip.open(member)
+        with src, open(out_file + ".part", "wb") as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(out_file + ".part", out_file)
+    _write_checksum(out_file, source)
+    return out_file
+
+
+def _download(url, out_file):
+    # requests is only needed when there's something to download.
+    import requests
+
+    with requests.get(url, stream=True, timeout=60) as req:
+        req.raise_for_status()
+        with open(out_file + ".part", "wb") as f:
+            for chunk in req.iter_content(1 << 20):
+                f.write(chunk)
+    os.replace(out_file + ".part", out_file)
+    return out_file
+
+
+def synthetic_words(n, seed=0):
+    """A list of n random lowercase 'words' of 1-12 letters."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 13, n)
+    letters = rng.integers(ord("a"), ord("z") + 1, lengths.sum(), dtype=np.uint8)
+    text = letters.tobytes().decode("ascii")
+    ends = np.cumsum(lengths)
+    return [text[e - k : e] for e, k in zip(ends.tolist(), lengths.tolist())]
+
+
+def _write_synthetic(n, seed, out_file, chunk=BATCH_SIZE):
+    import numpy as np
+
+    # One independent stream per chunk, so the file is written a
+    # chunk at a time and only one chunk is ever in memory.
+    seeds = np.random.SeedSequence(seed).spawn(-(-n // chunk))
+    with open(out_file + ".part", "w") as f:
+        for i, start in enumerate(range(0, n, chunk)):
+            f.write("\n".join(synthetic_words(min(chunk, n - start), seeds[i])))
+            f.write("\n")
+    os.replace(out_file + ".part", out_file)
+    _write_checksum(out_file)
+    return out_file
+
+
+def get_word_file(path=None, synthetic=None, seed=0, url=WORDS_URL):
+    """Return the name of a text file with one word per line.
+
+    path: use this local file. A .zip is extracted into the cache.
+    synthetic: make a file of this many random words (from seed)
+               instead, for benchmarking without the network.
+    Otherwise the 1M word file is downloaded the first time and the
+    cached copy is used after that.
+    """
+    if synthetic is not None:
+        out_file = os.path.join(cache_dir(), f"synthetic_words_{synthetic}_{seed}.txt")
+        if not is_cached(out_file):
+            _write_synthetic(synthetic, seed, out_file)
+        return out_file
+    if path is not None and not path.endswith(".zip"):
+        return path
+
+    if path is None:
+        # words.txt.zip is cached as words.txt
+        out_file = os.path.join(cache_dir(), WORDS_MEMBER)
+        if is_cached(out_file):
+            return out_file
+        print("Downloading the word file.")
+        zip_file = _download(url, os.path.join(cache_dir(), WORDS_MEMBER + ".zip"))
+        try:
+            return _extract(zip_file, out_file)
+        finally:
+            os.remove(zip_file)
+
+    # A local zip is cached under its name plus a hash of its full
+    # path, so two words.zip files in different places don't collide.
+    # is_cached() also checks that the zip hasn't changed since.
+    path_hash = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:12]
+    out_file = os.path.join(cache_dir(), f"{os.path.basename(path)[: -len('.zip')]}_{path_hash}")
+    if is_cached(out_file, source=path):
+        return out_file
+    return _extract(path, out_file, source=path)
+
+
+def iter_word_batches(filename, batch_size=BATCH_SIZE):
+    """Yield lists of up to batch_size words from a word file, stripped
+    and lowercased like get_data() always did."""
+    # Binary mode splits lines only at b"\n", same as readlines() on
+    # the zip member did.
+    with open(filename, "rb") as f:
+        while True:
+            batch = [word.decode("utf-8").strip().lower() for word in itertools.islice(f, batch_size)]
+            if not batch:
+                return
+            yield batch
+
+
+def load_words(filename):
+    """All of the words of a word file in one list."""
+    words = []
+    for batch in iter_word_batches(filename):
+        words.extend(batch)
+    return words
+
+
+if __name__ == "__main__":
+    import time
+
+    start = time.perf_counter()
+    fname = get_word_file(synthetic=1_000_000)
+    print(f"synthetic word file {fname}: {time.perf_counter() - start:.3f} sec")
+    start = time.perf_counter()
+    fname = get_word_file(synthetic=1_000_000)
+    print(f"again from the cache: {time.perf_counter() - start:.4f} sec")
+    nwords = sum(len(batch) for batch in iter_word_batches(fname))
+    print(f"{nwords} words")